@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Generates a synthetic CG stream from the analyses in katersat.sqlite, for benchmarks that need realistic input.
+# Roots are drawn from kat_long_raw with a Zipf distribution over a fixed vocabulary, so that words recur as in running text,
+# and each cohort gets several readings of the same root with different derivations and endings, as ambiguous cohorts do.
+# Readings also get Hyb/ and Sem/ tags, @-functions and #n->m dependencies, and sentences are separated by punctuation
+# cohorts, blank lines and the occasional stream command. The same options and seed always give the same output.
+# Usage: bench/corpus.py [options] > corpus.cg
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import regex as re
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import katersat
+import cg
+
+rx_root = re.compile(r'^("[^"]+"(?: \S+)*? (?:' + cg.WCS + r'))(?: |$)')
+rx_der = re.compile(r'^(?:' + cg.WCS + r') ((?:\p{Lu}[_\p{Lu}]+)(?: \S+)*? (?:N|V))$')
+
+# Used when the lexicon has no derivational morphemes of its own
+DERS = ['LIK V', 'SOQ N', 'NNGUAQ N', 'TUQ N', 'GE V', 'KKU V Gram/TV', 'U V', 'NIQ N', 'LLAR V', 'SSA V']
+ENDINGS = {
+	'N': ['Abs Sg', 'Abs Pl', 'Rel Sg', 'Rel Pl', 'Ins Sg', 'Lok Sg', 'Lok Pl', 'Abl Sg', 'Trm Sg', 'Abs Sg 3SgPoss', 'Rel Sg 3PlPoss', 'Lok Pl 1SgPoss'],
+	'V': ['Ind 3Sg', 'Ind 3Pl', 'Ind 1Sg', 'Ind 3Sg 3SgO', 'Ind 3Pl 3SgO', 'Ind 1Sg 3PlO', 'Cont 3SgO', 'Cau 3Sg', 'Con 3Pl', 'Par 3Sg', 'Imp 2Sg', 'Itr 3Sg'],
+}
+FUNCS = ['@SUBJ>', '@OBJ>', '@<SUBJ', '@<OBJ', '@ADVL>', '@<ADVL', '@PRED', '@N<', '@>N', '@i-OBJ']
+PUNCT = ['.', ',', '?', '!', ':']
+
+
+def options(parser):
+	parser.add_argument('-n', '--readings', type=int, default=20000, help='approximate number of readings to generate')
+	parser.add_argument('-a', '--ambiguity', type=int, default=3, help='maximum number of readings per cohort')
+	parser.add_argument('-v', '--vocab', type=int, default=5000, help='number of distinct roots to draw from')
+	parser.add_argument('-z', '--zipf', type=float, default=1.1, help='Zipf exponent of root frequencies; higher repeats more')
+	parser.add_argument('--hyb', type=float, default=0.02, help='fraction of readings with a Hyb/ tag')
+	parser.add_argument('--sem', type=float, default=0.1, help='fraction of readings that already have Sem/ tags')
+	parser.add_argument('--seed', type=int, default=1)
+
+
+# Yields the lines of a CG stream generated from the database at path
+def generate(path, readings=20000, ambiguity=3, vocab=5000, zipf=1.1, hyb=0.02, sem=0.1, seed=1):
+	rnd = random.Random(seed)
+	con = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+	db = con.cursor()
+
+	roots = set()
+	ders = set()
+	for ana, in db.execute("SELECT fst_ana FROM kat_long_raw ORDER BY rowid ASC"):
+		if m := rx_root.match(ana):
+			roots.add(m[1])
+		elif m := rx_der.match(ana):
+			ders.add(m[1])
+	roots = sorted(roots)
+	ders = sorted(ders) or DERS
+	sems = sorted(katersat.load_sem_map(db).values())
+	con.close()
+	if not roots:
+		raise ValueError(f'{path} has no analyses to generate readings from')
+
+	rnd.shuffle(roots)
+	roots = roots[:vocab]
+	cum = list(itertools.accumulate(1 / (k + 1) ** zipf for k in range(len(roots))))
+
+	def reading(root, k, head):
+		r = root
+		if rnd.random() < hyb:
+			r = r.replace('" ', '" Hyb/2-1 ', 1)
+		for _ in range(rnd.choice([0, 0, 1, 1, 2, 3])):
+			r += ' ' + rnd.choice(ders)
+		wc = r.rsplit(' ', 1)[-1]
+		if rnd.random() < sem and sems:
+			r += ' Sem/' + rnd.choice(sems)
+		if wc in ENDINGS:
+			r += ' ' + rnd.choice(ENDINGS[wc])
+		r += ' ' + rnd.choice(FUNCS)
+		return f'\t{r} #{k}->{head}'
+
+	n = 0
+	while n < readings:
+		size = rnd.randint(4, 15)
+		for k in range(1, size + 1):
+			root = rnd.choices(roots, cum_weights=cum)[0]
+			form = root.split('"')[1]
+			yield f'"<{form}>"'
+			head = rnd.randint(0, size)
+			for _ in range(rnd.randint(1, ambiguity)):
+				# Most cohorts are ambiguous between analyses of one root, some between different roots
+				if rnd.random() < 0.2:
+					root = rnd.choices(roots, cum_weights=cum)[0]
+				yield reading(root, k, head)
+				n += 1
+		p = rnd.choice(PUNCT)
+		yield f'"<{p}>"'
+		yield f'\t"{p}" CLB #{size + 1}->0'
+		yield ''
+		if rnd.random() < 0.05:
+			yield '<STREAMCMD:FLUSH>'
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(prog='bench/corpus.py', description='Generates a synthetic CG stream from katersat.sqlite')
+	options(parser)
+	parser.add_argument('db', nargs='?', default=os.path.join(katersat.DIR, 'katersat.sqlite'))
+	args = parser.parse_args()
+	out = sys.stdout
+	for line in generate(args.db, args.readings, args.ambiguity, args.vocab, args.zipf, args.hyb, args.sem, args.seed):
+		out.write(line + '\n')
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Compares the latency of analysis lookups through the substr(fst_ana,1,16) expression index with joins,
+# against exact probes of kat_long_lookup. Half of the probed analyses exist, half do not, as in real lookups.
+# Usage: bench/lookup.py [katersat.sqlite] [probes per statement] [statements]
+import sys
+import os
+import random
+import sqlite3
+import time
+
+dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(dir, 'katersat.sqlite')
+batch = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+n = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+con = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+db = con.cursor()
+
+random.seed(1)
+anas = [r[0] for r in db.execute("SELECT fst_ana FROM kat_long_raw")]
+batches = []
+for _ in range(n):
+	b = random.choices(anas, k=batch // 2)
+	b += [a + ' Abs Sg' for a in random.choices(anas, k=batch - len(b))]
+	batches.append(b)
+
+
+def substr(b):
+	rv = {a: [] for a in b}
+	keys = list({a[0:16] for a in b})
+	db.execute("SELECT fst_ana, kl.lex_id, COALESCE(let_attrs, 0), lex_semclass FROM kat_long_raw NATURAL JOIN kat_lexemes as kl LEFT JOIN kat_lexeme_attrs as kla ON (kl.lex_id = kla.lex_id) WHERE lex_semclass != 'meta-cat-lib' AND substr(fst_ana,1,16) IN (" + ','.join(['?'] * len(keys)) + ")", keys)
+	while r := db.fetchone():
+		if r[0] in rv:
+			rv[r[0]].append((r[1], r[2], r[3] == 'UNK'))
+	return rv
+
+
+def exact(b):
+	rv = {a: [] for a in b}
+	keys = list(rv)
+	db.execute("SELECT fst_ana, lex_id, let_attrs, lex_semclass FROM kat_long_lookup WHERE fst_ana IN (" + ','.join(['?'] * len(keys)) + ") ORDER BY fst_ana ASC, lex_id ASC, seq ASC", keys)
+	while r := db.fetchone():
+		rv[r[0]].append((r[1], r[2], r[3] == 'UNK'))
+	return rv
+
+
+for b in batches[0:50]:
+	if substr(b) != exact(b):
+		print('Mismatch between the two lookups', file=sys.stderr)
+		sys.exit(1)
+
+print(f'{len(anas)} analyses, {n} statements of {batch} probes')
+for name, fn in (('substr index + joins', substr), ('kat_long_lookup', exact)):
+	ts = []
+	for b in batches:
+		t = time.perf_counter()
+		fn(b)
+		ts.append(time.perf_counter() - t)
+	ts.sort()
+	print(f'{name:>22}: mean {sum(ts) / len(ts) * 1e6:8.1f} µs, p50 {ts[len(ts) // 2] * 1e6:8.1f} µs, p99 {ts[int(len(ts) * 0.99)] * 1e6:8.1f} µs, {sum(ts) / (n * batch) * 1e6:6.2f} µs/probe')
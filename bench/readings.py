@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Micro-benchmark of reading tokenization, the old step-wise regexes against cg.Reading
+# Usage: bench/readings.py < input.cg
+import sys
+import os
+import time
+import regex as re
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import cg
+
+
+def before(line):
+	line = line.strip()
+	hyb = (' Hyb/' in line and not ' Hyb/1-' in line)
+
+	suffix = ''
+	if m := re.search(r' (?:\d?(?:Sg|Pl|Du)(?:Poss|O)?)( (?:ADV-|CONJ-)?(?:LI|LU|LUUNNIIT)(?: |$).*)$', line):
+		suffix += m[1]
+		line = re.sub(r'( (?:ADV-|CONJ-)?(?:LI|LU|LUUNNIIT)(?: |$).*)$', '', line)
+	if m := re.search(r'( ¤\S+)( |$)', line):
+		suffix += m[1]
+		line = line.replace(m[1], '')
+	if m := re.search(r'((?: %\S+)+)( |$)', line):
+		suffix += m[1]
+		line = line.replace(m[1], '')
+	if m := re.search(r'((?: @\S+)+)( |$)', line):
+		suffix += m[1]
+		line = line.replace(m[1], '')
+	if m := re.search(r'( #\d+->\d+)( |$)', line):
+		suffix += m[1]
+		line = line.replace(m[0], '')
+
+	origs = re.split(r' (?=(?:(?:i?(?:N|V|Pali|Conj|Adv|Interj|Pron|Prop|Num|Symbol))|(?:\p{Lu}[_\p{Lu}]+)|U)(?: |$))', line)
+	cleans = []
+	for orig in origs:
+		orig = re.sub(r' Gram/((?:[HIT]V)|(?:Refl))\b', r' gram/\1', orig)
+		orig = re.sub(r' (Gram|Dial|Orth|O[lL]ang|Heur|Hyb|Err)/(\S+)', r'', orig)
+		orig = re.sub(r' (ADV|CONJ)-L', r' L', orig)
+		orig = orig.replace(' gram/', ' Gram/')
+		cleans.append(orig)
+	return (line, suffix, hyb, origs, cleans)
+
+
+def after(line):
+	rd = cg.Reading(line)
+	return (rd.line, rd.suffix, rd.hyb, rd.origs, rd.cleans)
+
+
+lines = []
+for line in sys.stdin:
+	line = line.rstrip()
+	if line.startswith('\t"') and re.search(r' (?:N|V|Pali|Conj|Adv|Interj|Pron|Prop|Num|Symbol)(?: |$)', line):
+		lines.append(line)
+if not lines:
+	sys.exit('No readings on stdin')
+
+for line in lines:
+	if before(line) != after(line):
+		sys.exit(f'Mismatch: {line}')
+
+for name, fn in [('before', before), ('after', after)]:
+	t = time.perf_counter()
+	rounds = 0
+	while (el := time.perf_counter() - t) < 2.0:
+		for line in lines:
+			fn(line)
+		rounds += 1
+	print(f'{name}: {rounds * len(lines) / el:.0f} readings/s')
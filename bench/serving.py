@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Compares the time per lookup in katersat.sqlite and in the read-optimised katersat-serving.sqlite that update.py builds,
+# looking analyses up one by one as the scripts do. Half of the analyses exist and half don't, as most candidates don't.
+# Usage: bench/serving.py [directory with katersat.sqlite and katersat-serving.sqlite] [lookups]
+import sys
+import os
+import sqlite3
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import katersat
+
+dir = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else katersat.DIR)
+n = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+
+# Mean time in microseconds per lookup in the database at path
+def latency(path, anas, immutable=False):
+	con = sqlite3.connect(f'file:{path}?mode=ro' + ('&immutable=1' if immutable else ''), uri=True, isolation_level=None)
+	if immutable:
+		con.execute(f"PRAGMA mmap_size = {256 << 20}")
+	lk = katersat.Lookup(con, absent_size=0)
+	# Once to warm up, and once to time
+	for _ in range(2):
+		t = time.perf_counter()
+		for ana in anas:
+			lk.rows([ana])
+		us = (time.perf_counter() - t) / len(anas) * 1000000
+	con.close()
+	return us
+
+
+con = sqlite3.connect(f'file:{os.path.join(dir, "katersat.sqlite")}?mode=ro', uri=True)
+anas = [r[0] for r in con.execute("SELECT fst_ana FROM kat_long_lookup ORDER BY random() LIMIT ?", [n // 2])]
+con.close()
+anas += [ana + ' Abs Sg' for ana in anas]
+
+for fn, imm in (('katersat.sqlite', False), ('katersat-serving.sqlite', True)):
+	path = os.path.join(dir, fn)
+	print(f'{fn}: {os.path.getsize(path) / 1048576:.1f} MiB, {latency(path, anas, imm):.1f} us per lookup')
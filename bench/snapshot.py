@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Compares the lookup back-ends: querying SQLite, the -i in-memory index, and the -m memory-mapped snapshot.
+# Each runs in a fresh process, reporting the time until the first lookup is answered, the time per lookup, and memory growth:
+# private memory stays with each process, while file-backed pages of the snapshot are shared by all processes mapping it.
+# Usage: bench/snapshot.py [directory with katersat.sqlite and katersat.snap] [lookups]
+import sys
+import os
+import random
+import sqlite3
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import katersat
+
+dir = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else katersat.DIR)
+n = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+
+def memory():
+	rv = {}
+	with open('/proc/self/status') as f:
+		for line in f:
+			k, v = line.split(':', 1)
+			if k in ('RssAnon', 'RssFile'):
+				rv[k] = int(v.split()[0]) / 1024
+	return rv
+
+
+def run(mode, anas, out):
+	mem0 = memory()
+	t = time.perf_counter()
+	con = sqlite3.connect('file:' + dir + '/katersat.sqlite?mode=ro', uri=True)
+	snap = katersat.open_mapped(dir, katersat.Snapshot, 'katersat.snap', 'snapshot', katersat.data_version(con)) if mode == 'mmap' else None
+	lk = katersat.lookup(con, mode == 'index', snap)
+	lk.find(anas[0])
+	first = time.perf_counter() - t
+
+	t = time.perf_counter()
+	found = 0
+	for k in range(0, len(anas), 50):
+		found += sum(1 for v in lk.find_many(anas[k:k+50]).values() if v)
+	per = (time.perf_counter() - t) / len(anas)
+	mem = memory()
+	out.write(f'{mode:>7}: first lookup after {first * 1000:8.1f} ms, {per * 1e6:6.2f} µs/lookup, {found} found, private +{mem["RssAnon"] - mem0["RssAnon"]:6.1f} MiB, file-backed +{mem["RssFile"] - mem0["RssFile"]:6.1f} MiB\n')
+
+
+con = sqlite3.connect('file:' + dir + '/katersat.sqlite?mode=ro', uri=True)
+random.seed(1)
+pool = [r[0] for r in con.execute("SELECT fst_ana FROM kat_long_lookup")]
+con.close()
+anas = random.choices(pool, k=n // 2) + [a + ' Abs Sg' for a in random.choices(pool, k=n - n // 2)]
+random.shuffle(anas)
+
+print(f'{len(pool)} analyses, {n} lookups, half of which miss')
+for mode in ('sqlite', 'index', 'mmap'):
+	r, w = os.pipe()
+	if pid := os.fork():
+		os.close(w)
+		with os.fdopen(r) as f:
+			sys.stdout.write(f.read())
+		os.waitpid(pid, 0)
+	else:
+		os.close(r)
+		with os.fdopen(w, 'w') as f:
+			run(mode, anas, f)
+		os._exit(0)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Benchmarks apply-sems.py, gloss.py and update.py on a synthetic corpus generated from katersat.sqlite (see corpus.py),
+# and saves the results as JSON, so that runs on different versions can be compared with --compare.
+# The filters are run twice: in-process, which gives per-reading latency, SQL query counts and cache hit rates, and as the
+# actual scripts, which gives throughput and peak RSS. update.py is run on a copy of the scripts in a scratch directory, once
+# as a full build from data.sql dumped from katersat.sqlite, and once as an incremental update after changing some lexemes.
+# Usage: bench/suite.py [-o results.json] [--compare old.json] [--args '-i'] [corpus options]
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shlex
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+bench = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(bench, '..'))
+import katersat
+import cg
+import corpus
+from tagger import SemTagger
+from glosser import Glosser
+
+
+# The version of the data in the database at db
+def version(db):
+	con = sqlite3.connect(f'file:{db}?mode=ro', uri=True)
+	rv = katersat.data_version(con)
+	con.close()
+	return rv
+
+
+def percentile(xs, p):
+	if not xs:
+		return 0
+	return xs[min(len(xs) - 1, int(len(xs) * p / 100))]
+
+
+def rate(hits, misses):
+	return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+# Runs a filter over the lines in a forked process, so that each filter starts cold, and returns its measurements and output
+def measure(make, lines, conn):
+	filt = make()
+	queries = 0
+
+	def count(stmt):
+		nonlocal queries
+		queries += 1
+	filt.con.set_trace_callback(count)
+
+	lat = []
+	outs = []
+	t0 = time.perf_counter()
+	# With --cohorts, the time of a cohort is split evenly over its readings
+	items = cg.cohorts(lines) if filt.cohorts else ([line] for line in lines)
+	for item in items:
+		t = time.perf_counter()
+		outs.extend(filt.process_cohort(item))
+		if k := sum(1 for line in item if cg.is_reading(line)):
+			lat.extend([(time.perf_counter() - t) / k] * k)
+	total = time.perf_counter() - t0
+	lat.sort()
+	stats = filt.get_stats()
+	conn.send(({
+		'readings': len(lat),
+		'seconds': round(total, 3),
+		'readings_per_s': round(len(lat) / total, 1) if total else None,
+		'p50_ms': round(percentile(lat, 50) * 1000, 4),
+		'p99_ms': round(percentile(lat, 99) * 1000, 4),
+		'max_ms': round(lat[-1] * 1000, 4) if lat else 0,
+		'queries': queries,
+		'queries_per_reading': round(queries / len(lat), 3) if lat else None,
+		'cache_hit_rate': rate(stats['hit'], stats['miss']),
+		'span_hit_rate': rate(stats['span_hit'], stats['span_miss']),
+		'stats': stats,
+	}, outs))
+	conn.close()
+
+
+def in_process(make, lines):
+	parent, child = multiprocessing.Pipe(duplex=False)
+	p = multiprocessing.get_context('fork').Process(target=measure, args=(make, lines, child))
+	p.start()
+	child.close()
+	rv = parent.recv()
+	p.join()
+	return rv
+
+
+# Runs a command with input from a file, returning the wall time and the peak RSS of the process in MiB
+def run(cmd, stdin=None, cwd=None, env=None, stdout=subprocess.DEVNULL):
+	fin = open(stdin, 'rb') if stdin else subprocess.DEVNULL
+	t = time.perf_counter()
+	p = subprocess.Popen(cmd, stdin=fin, stdout=stdout, cwd=cwd, env=env)
+	# wait4() rather than wait(), for the resource usage of just this child
+	_, status, ru = os.wait4(p.pid, 0)
+	p.returncode = os.waitstatus_to_exitcode(status)
+	secs = time.perf_counter() - t
+	if stdin:
+		fin.close()
+	if p.returncode:
+		raise subprocess.CalledProcessError(p.returncode, cmd)
+	# ru_maxrss is in KiB on Linux
+	return secs, ru.ru_maxrss / 1024
+
+
+def script(name, args, path, readings):
+	secs, rss = run([sys.executable, os.path.join(katersat.DIR, name)] + args, stdin=path)
+	return {'seconds': round(secs, 3), 'readings_per_s': round(readings / secs, 1), 'peak_rss_mib': round(rss, 1)}
+
+
+# Writes the tables that data.sql holds, as update.py expects to download it
+def dump(db, path, change=0):
+	con = sqlite3.connect(f'file:{db}?mode=ro', uri=True)
+	with open(path, 'w', encoding='UTF-8') as out:
+		tables = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name ASC")]
+		for t in tables:
+			if t in katersat.DERIVED:
+				continue
+			cols = [r[1] for r in con.execute(f'PRAGMA table_info({t})')]
+			vals = " || ',' || ".join(f'quote({c})' for c in cols)
+			# Changing the semantic class of every change-th lexeme is enough to make the incremental update do real work
+			if change and t == 'kat_lexemes':
+				vals = vals.replace('quote(lex_semclass)', f"CASE WHEN lex_id % {change} = 0 THEN quote('UNK') ELSE quote(lex_semclass) END")
+			for row, in con.execute(f"SELECT {vals} FROM {t}"):
+				out.write(f'INSERT INTO {t} VALUES ({row});\n')
+	con.close()
+
+
+def update(db):
+	rv = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		for fn in os.listdir(katersat.DIR):
+			if fn.endswith('.py') or fn == 'schema.sql':
+				shutil.copy(os.path.join(katersat.DIR, fn), tmp)
+		# A stand-in for curl that serves the dumped data.sql instead of downloading it
+		os.mkdir(f'{tmp}/bin')
+		with open(f'{tmp}/bin/curl', 'w') as f:
+			# The new ETag is older than data.sql, which is what makes update.py hash it to see whether it changed
+			f.write('#!/bin/sh\ncp "$BENCH_DATA" data.sql\necho "$BENCH_DATA" > etag-new.txt\ntouch -d @0 etag-new.txt\n')
+		os.chmod(f'{tmp}/bin/curl', 0o755)
+		env = dict(os.environ, PATH=f'{tmp}/bin:' + os.environ['PATH'])
+
+		dump(db, f'{tmp}/full.sql')
+		dump(db, f'{tmp}/changed.sql', change=100)
+		for kind, data in (('full', 'full.sql'), ('incremental', 'changed.sql')):
+			env['BENCH_DATA'] = f'{tmp}/{data}'
+			with open(f'{tmp}/{kind}.log', 'w+') as log:
+				secs, rss = run([sys.executable, 'update.py'], cwd=tmp, env=env, stdout=log)
+				log.seek(0)
+				if 'Katersat updated' not in log.read():
+					raise RuntimeError(f'update.py did not do a {kind} update')
+			rv[kind] = {'seconds': round(secs, 3), 'peak_rss_mib': round(rss, 1)}
+		rv['db_mib'] = round(os.path.getsize(f'{tmp}/katersat.sqlite') / 1048576, 1)
+		rv['serving_mib'] = round(os.path.getsize(f'{tmp}/katersat-serving.sqlite') / 1048576, 1)
+	return rv
+
+
+# Prints how each number in new changed from old
+def compare(old, new, path=''):
+	for k, v in new.items():
+		if k not in old:
+			continue
+		if isinstance(v, dict) and isinstance(old[k], dict):
+			compare(old[k], v, f'{path}{k}.')
+		elif isinstance(v, (int, float)) and isinstance(old[k], (int, float)) and not isinstance(v, bool) and old[k]:
+			print(f'{path}{k}: {old[k]} -> {v} ({(v - old[k]) / old[k] * 100:+.1f}%)', file=sys.stderr)
+
+
+def main():
+	parser = argparse.ArgumentParser(prog='bench/suite.py', description='Benchmarks apply-sems.py, gloss.py and update.py on a synthetic corpus')
+	corpus.options(parser)
+	parser.add_argument('-o', '--output', help='write the results to this JSON file instead of stdout')
+	parser.add_argument('--compare', metavar='JSON', help='also print the change from the results of an earlier run')
+	parser.add_argument('--args', default='', help='options for the filters, such as "-i" or "-m --span-cache-size 0"')
+	parser.add_argument('--skip-update', action='store_true', help='do not benchmark update.py, which takes a while')
+	args = parser.parse_args()
+
+	db = os.path.join(katersat.DIR, 'katersat.sqlite')
+	fargs = shlex.split(args.args)
+	fparser = argparse.ArgumentParser()
+	katersat.add_arguments(fparser)
+	opts = katersat.filter_options(fparser.parse_args(fargs))
+
+	res = {
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'git': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=katersat.DIR, capture_output=True, text=True).stdout.strip(),
+		'data_version': version(db),
+		'python': platform.python_version(),
+		'args': args.args,
+	}
+	copts = {k: getattr(args, k) for k in ('readings', 'ambiguity', 'vocab', 'zipf', 'hyb', 'sem', 'seed')}
+	lines = list(corpus.generate(db, **copts))
+	res['corpus'] = dict(copts, lines=len(lines), readings=sum(1 for line in lines if cg.is_reading(line)))
+
+	with tempfile.TemporaryDirectory() as tmp:
+		with open(f'{tmp}/in.cg', 'w', encoding='UTF-8') as f:
+			f.write('\n'.join(lines) + '\n')
+
+		print('apply-sems...', file=sys.stderr)
+		res['apply-sems'], tagged = in_process(lambda: SemTagger(**opts), lines)
+		res['apply-sems']['script'] = script('apply-sems.py', fargs, f'{tmp}/in.cg', res['apply-sems']['readings'])
+		with open(f'{tmp}/tagged.cg', 'w', encoding='UTF-8') as f:
+			f.write('\n'.join(tagged) + '\n')
+
+		print('gloss...', file=sys.stderr)
+		res['gloss'], _ = in_process(lambda: Glosser(**opts), tagged)
+		res['gloss']['script'] = script('gloss.py', fargs, f'{tmp}/tagged.cg', res['gloss']['readings'])
+
+	if not args.skip_update:
+		print('update...', file=sys.stderr)
+		res['update'] = update(db)
+
+	out = json.dumps(res, indent='\t')
+	if args.output:
+		with open(args.output, 'w') as f:
+			f.write(out + '\n')
+	else:
+		print(out)
+	if args.compare:
+		with open(args.compare) as f:
+			compare(json.load(f), res)
+
+
+if __name__ == '__main__':
+	main()
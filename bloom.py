@@ -0,0 +1,63 @@
+import sqlite3
+import sys
+import zlib
+import snapshot
+from array import array
+
+# A Bloom filter of the analyses in kat_long_lookup, so that lookups can reject most of the candidates that no analysis has
+# without asking SQLite. It is blocked: each analysis sets 5 bits in one 64-bit word, so that testing it takes one hash and
+# one word, at the cost of a somewhat higher false positive rate than a plain Bloom filter of the same size.
+# The file is MAGIC and the metadata, as snapshot.header() writes them, and then the words.
+MAGIC = b'KATBLOM1'
+
+
+# Returns the word of an analysis and the mask of its bits in that word. CRC-32 is the cheapest hash Python has, and the CRC-32
+# of the reversed analysis is independent enough of it to pick the word with.
+def _hash(ana, words):
+	key = ana.encode('UTF-8')
+	h = zlib.crc32(key)
+	return zlib.crc32(key[::-1]) % words, 1 << (h & 63) | 1 << (h >> 6 & 63) | 1 << (h >> 12 & 63) | 1 << (h >> 18 & 63) | 1 << (h >> 24 & 63)
+
+
+# Writes a Bloom filter of the analyses in the database at db to path, with about bits bits per analysis, tagged with the data version
+def write(db, path, version, bits=16):
+	con = sqlite3.connect(f'file:{db}?mode=ro', uri=True)
+	anas = [r[0] for r in con.execute("SELECT DISTINCT fst_ana FROM kat_long_lookup")]
+	con.close()
+
+	n = max(len(anas) * bits // 64, 1)
+	words = array('Q', bytes(8 * n))
+	for ana in anas:
+		w, mask = _hash(ana, n)
+		words[w] |= mask
+
+	meta = {
+		'version': version,
+		'byteorder': sys.byteorder,
+		'keys': len(anas),
+		'words': n,
+	}
+	with open(path, 'wb') as out:
+		out.write(snapshot.header(MAGIC, meta))
+		out.write(words.tobytes())
+	return len(anas)
+
+
+# A memory-mapped Bloom filter, shared by every process that maps the same file
+class Bloom:
+	def __init__(self, path):
+		self.mm, meta, base = snapshot.map_file(path, MAGIC, 'a Katersat Bloom filter')
+		self.version = meta['version']
+		self.n = meta['words']
+		self.mv = memoryview(self.mm)
+		self.words = self.mv[base:base+8*self.n].cast('Q')
+
+	# Whether some analysis may be ana. False is certain, True only likely.
+	def __contains__(self, ana):
+		w, mask = _hash(ana, self.n)
+		return self.words[w] & mask == mask
+
+	def close(self):
+		self.words.release()
+		self.mv.release()
+		self.mm.close()
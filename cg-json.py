@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+import cg
+
+parser = argparse.ArgumentParser(prog='cg-json.py', description='Converts a stream of CG-formatted text to the JSON lines of --in-format json, or back with -r')
+parser.add_argument('-r', '--reverse', action='store_true', help='convert JSON lines to CG text')
+parser.add_argument('-u', '--unbuffered', action='store_true', help='flush after every line')
+args = parser.parse_args()
+
+conv = (lambda line: cg.text(cg.read_json(line))) if args.reverse else (lambda line: cg.write_json(line.rstrip('\n')))
+output = cg.Output(sys.stdout, args.unbuffered)
+for line in sys.stdin:
+	output.write(conv(line))
+output.close()
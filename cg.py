@@ -0,0 +1,337 @@
+import json
+import sys
+import threading
+import regex as re
+from functools import cached_property
+
+WCS = 'N|V|Pali|Conj|Adv|Interj|Pron|Prop|Num|Symbol'
+
+rx_reading = re.compile(r' (?:' + WCS + r')(?: |$)')
+rx_split = re.compile(r' (?=(?:(?:i?(?:' + WCS + r'))|(?:\p{Lu}[_\p{Lu}]+)|U)(?: |$))')
+rx_wc = re.compile(r'^i?(' + WCS + r')(?: |$)(.*)$')
+rx_der = re.compile(r' Der/([nv])[nv]( |$)')
+
+rx_gram = re.compile(r' Gram/((?:[HIT]V)|(?:Refl))\b')
+rx_tags = re.compile(r' (Gram|Dial|Orth|O[lL]ang|Heur|Hyb|Err)/(\S+)')
+rx_adv_l = re.compile(r' (ADV|CONJ)-L')
+rx_sem_ct = re.compile(r' i?Sem/(Concessive|Temporal)')
+rx_sem = re.compile(r' i?Sem/(\S+)')
+
+# Tokens that make up the suffix which is split off before lookups and glued back on afterwards
+rx_num = re.compile(r'\d?(?:Sg|Pl|Du)(?:Poss|O)?')
+rx_dep = re.compile(r'#\d+->\d+')
+LIS = {p + li for p in ('', 'ADV-', 'CONJ-') for li in ('LI', 'LU', 'LUUNNIIT')}
+
+rx_sfx_enc = re.compile(r' (?:\d?(?:Sg|Pl|Du)(?:Poss|O)?)( (?:ADV-|CONJ-)?(?:LI|LU|LUUNNIIT)(?: |$).*)$')
+rx_sfx_cut = re.compile(r'( (?:ADV-|CONJ-)?(?:LI|LU|LUUNNIIT)(?: |$).*)$')
+rx_sfx_cur = re.compile(r'( ¤\S+)( |$)')
+rx_sfx_pct = re.compile(r'((?: %\S+)+)( |$)')
+rx_sfx_at = re.compile(r'((?: @\S+)+)( |$)')
+rx_sfx_dep = re.compile(r'( #\d+->\d+)( |$)')
+
+
+# Tokens that make morphemes before them internal: derivations, and in gloss.py also U, or word classes
+rx_der_sem = re.compile(r'\p{Lu}[_\p{Lu}]+')
+rx_der_sem_u = re.compile(r'U|\p{Lu}[_\p{Lu}]+')
+rx_der_wc = re.compile(r'U|\p{Lu}\p{Lu}+|' + WCS)
+WC_SET = frozenset(WCS.split('|'))
+
+
+# Whether a line is a CG reading that has a word class we can do anything with
+def is_reading(line):
+	return line.startswith('\t"') and rx_reading.search(line) is not None
+
+
+# Returns the word class and flexion following a morpheme, if any
+def word_class(clean):
+	if not ((m := rx_wc.match(clean)) or (m := rx_der.search(clean))):
+		return '', ''
+	return m[1][0:1].upper() + m[1][1:], m[2]
+
+
+# Splits a stripped reading into the part that is looked up and the suffix which is glued back on afterwards:
+# LI/LU enclitics, a ¤ tag, a run of % tags, a run of @ functions, and a #n->m dependency, in a single scan of the tokens
+def split_suffix(line):
+	ts = line.split(' ')
+	n = len(ts)
+
+	# Enclitics cut the reading at the first one, but only if one of them follows a number tag
+	cut = n
+	enc = 0
+	for k in range(1, n):
+		if ts[k] in LIS:
+			if cut == n:
+				cut = k
+			if k > 1 and rx_num.fullmatch(ts[k-1]):
+				enc = k
+				break
+	if not enc:
+		cut = n
+
+	cur = ''
+	pcts = []
+	ats = []
+	pct = at = 0
+	rest = [ts[0]]
+	dep = 0
+	for t in ts[1:cut]:
+		if len(t) > 1 and t[0] in '¤%@#':
+			if t[0] == '¤' and not cur:
+				cur = t
+				continue
+			if t[0] == '%' and pct < 2:
+				pcts.append(t)
+				pct = 1
+				continue
+			if t[0] == '@' and at < 2:
+				pct = pct and 2
+				ats.append(t)
+				at = 1
+				continue
+			if t[0] == '#' and not dep and rx_dep.fullmatch(t):
+				pct = pct and 2
+				at = at and 2
+				dep = len(rest)
+				rest.append(t)
+				continue
+			# Repeated tags are removed wherever they occur, which only the step-wise replacements get right
+			return _split_suffix_chain(line)
+		pct = pct and 2
+		at = at and 2
+		rest.append(t)
+
+	suffix = ''
+	if enc:
+		suffix += ' ' + ' '.join(ts[enc:])
+	if cur:
+		suffix += ' ' + cur
+	if pcts:
+		suffix += ' ' + ' '.join(pcts)
+	if ats:
+		suffix += ' ' + ' '.join(ats)
+	if dep:
+		suffix += ' ' + rest[dep]
+		# The dependency is removed along with the space on either side of it
+		if dep + 1 < len(rest):
+			rest[dep-1:dep+2] = [rest[dep-1] + rest[dep+1]]
+		else:
+			del rest[dep]
+	return ' '.join(rest), suffix
+
+
+def _tidy(orig):
+	orig = rx_gram.sub(r' gram/\1', orig)
+	orig = rx_tags.sub('', orig)
+	orig = rx_adv_l.sub(r' L', orig)
+	return orig.replace(' gram/', ' Gram/')
+
+
+# A stripped reading, split into morphemes on demand
+class Reading:
+	def __init__(self, line):
+		line = line.strip()
+		self.hyb = (' Hyb/' in line and not ' Hyb/1-' in line)
+		self.line, self.suffix = split_suffix(line)
+
+	# A reading that is already split from its suffix, and maybe into morphemes, as stages pass them on and read_json() reads them
+	@classmethod
+	def split(cls, line, suffix, origs=None):
+		rd = cls.__new__(cls)
+		rd.line = line
+		rd.suffix = suffix
+		if origs is not None:
+			rd.origs = origs
+		return rd
+
+	@cached_property
+	def hyb(self):
+		line = self.line + self.suffix
+		return (' Hyb/' in line and not ' Hyb/1-' in line)
+
+	def text(self):
+		return '\t' + self.line + self.suffix
+
+	@cached_property
+	def origs(self):
+		return rx_split.split(self.line)
+
+	# Morphemes without tags that don't take part in lookups
+	@cached_property
+	def cleans(self):
+		return [_tidy(orig) for orig in self.origs]
+
+	# As cleans, but also without the Sem/ tags that no lexeme has
+	@cached_property
+	def scleans(self):
+		return [rx_sem_ct.sub('', clean) for clean in self.cleans]
+
+	# As cleans, but without any Sem/ tags
+	@cached_property
+	def nosems(self):
+		return [rx_sem.sub('', sclean) for sclean in self.scleans]
+
+
+# Marks the Sem/ tags among tokens as internal if a derivation follows them, as ders matches it, in one pass from the end.
+# This is what repeating re.sub(r' (Sem/\S+.*? DER )', r' i\1') until nothing changes does, as a tag is internal if any token
+# after it but the last is a derivation. Tokens can be marked a part at a time, last part first: seen is whether the parts
+# after these have a derivation, last whether these tokens end the reading, and the return value is seen for the parts before.
+def mark_sems(tokens, ders, seen=False, last=True):
+	end = len(tokens) - 1 if last else len(tokens)
+	for k in range(len(tokens) - 1, -1, -1):
+		t = tokens[k]
+		if t.startswith('Sem/'):
+			if seen and len(t) > 4:
+				tokens[k] = 'i' + t
+		elif k < end and ders.fullmatch(t):
+			seen = True
+	return seen
+
+
+# Marks word classes that are followed by a derivation or another word class as internal, in one pass from the end.
+# As with mark_sems(), this is where repeating the re.sub() in gloss.py ends up: marking a word class never takes away
+# what makes one before it internal, as there is a later one that isn't marked, and the following token doesn't count.
+def mark_wcs(tokens):
+	n = len(tokens)
+	ends = [rx_der_wc.fullmatch(t) is not None for t in tokens]
+	seen = False
+	for k in range(n - 2, 0, -1):
+		if k + 2 <= n - 2 and ends[k+2]:
+			seen = True
+		if seen and tokens[k] in WC_SET:
+			tokens[k] = 'i' + tokens[k]
+	return tokens
+
+
+# The lines of a stream are passed between stages as text, or as Readings that are already split. In the structured format
+# of --in-format and --out-format json, a line is a JSON object, {"m": [morphemes], "s": suffix} for a reading, as Reading
+# splits it, and {"t": line} for any other line, so that a stage that reads another's output need not parse it again.
+def text(line):
+	return line if isinstance(line, str) else line.text()
+
+
+def read_json(line):
+	rec = json.loads(line)
+	if 'm' in rec:
+		return Reading.split(' '.join(rec['m']), rec.get('s', ''), rec['m'])
+	return rec['t']
+
+
+def write_json(line):
+	if isinstance(line, str):
+		if not is_reading(line):
+			return json.dumps({'t': line}, ensure_ascii=False)
+		line = Reading(line)
+	return json.dumps({'m': line.origs, 's': line.suffix}, ensure_ascii=False)
+
+
+# Whether an output line of either format ends a window of the stream, after which output is flushed
+def is_boundary(line):
+	return not line or line.startswith('<STREAMCMD:') or line == '{"t": ""}' or line.startswith('{"t": "<STREAMCMD:')
+
+
+# Groups the lines of a CG stream into blocks that can be processed on their own. A block ends at a window boundary
+# (a blank line or stream command), or before the next cohort once it has grown to size lines.
+def blocks(lines, size=1000):
+	block = []
+	for line in lines:
+		if isinstance(line, Reading):
+			block.append(line)
+			continue
+		if len(block) >= size and line.startswith('"<'):
+			yield block
+			block = []
+		block.append(line)
+		if not line.rstrip() or line.startswith('<STREAMCMD:'):
+			yield block
+			block = []
+	if block:
+		yield block
+
+
+# Groups the lines of a CG stream by cohort: the reading lines under a "<wordform>" line, subreadings included, as one
+# group, and every other line on its own. A cohort is only complete once the line after it has been read.
+def cohorts(lines):
+	group = []
+	for line in lines:
+		if isinstance(line, Reading) or line.startswith('\t'):
+			group.append(line)
+			continue
+		if group:
+			yield group
+			group = []
+		yield [line]
+	if group:
+		yield group
+
+
+# Writes output lines, flushing them at CG stream boundaries (blank lines, stream commands such as
+# <STREAMCMD:FLUSH>, and end of input), or when enough output has accumulated, or when it has waited for too long.
+# Unbuffered flushes every line, as is needed for live pipelines that don't send stream commands.
+class Output:
+	MAX_BYTES = 1 << 16
+
+	def __init__(self, out=None, unbuffered=False, delay=1.0):
+		self.out = out or sys.stdout
+		self.unbuffered = unbuffered
+		self.buf = []
+		self.size = 0
+		self.lock = threading.Lock()
+		self.timer = None
+		if not unbuffered and delay > 0:
+			self.delay = delay
+			self.done = threading.Event()
+			self.timer = threading.Thread(target=self._tick, daemon=True)
+			self.timer.start()
+
+	def _tick(self):
+		while not self.done.wait(self.delay):
+			self.flush()
+
+	def write(self, line):
+		with self.lock:
+			self.buf.append(line)
+			self.buf.append('\n')
+			self.size += len(line) + 1
+			if not (self.unbuffered or is_boundary(line) or self.size >= self.MAX_BYTES):
+				return
+			self._flush()
+
+	def _flush(self):
+		if self.buf:
+			self.out.write(''.join(self.buf))
+			self.buf = []
+			self.size = 0
+		self.out.flush()
+
+	def flush(self):
+		with self.lock:
+			if self.buf:
+				self._flush()
+
+	def close(self):
+		if self.timer:
+			self.done.set()
+			self.timer.join()
+		with self.lock:
+			self._flush()
+
+
+# The step-wise equivalent of split_suffix(), for the rare readings where it matters
+def _split_suffix_chain(line):
+	suffix = ''
+	if m := rx_sfx_enc.search(line):
+		suffix += m[1]
+		line = rx_sfx_cut.sub('', line)
+	if m := rx_sfx_cur.search(line):
+		suffix += m[1]
+		line = line.replace(m[1], '')
+	if m := rx_sfx_pct.search(line):
+		suffix += m[1]
+		line = line.replace(m[1], '')
+	if m := rx_sfx_at.search(line):
+		suffix += m[1]
+		line = line.replace(m[1], '')
+	if m := rx_sfx_dep.search(line):
+		suffix += m[1]
+		line = line.replace(m[0], '')
+	return line, suffix
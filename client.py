@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+import sys
+import socket
+import threading
+import argparse
+
+parser = argparse.ArgumentParser(prog='client.py', description='Pipes a stream of CG-formatted text through apply-sems.py or gloss.py running with --serve')
+parser.add_argument('socket')
+args = parser.parse_args()
+
+s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+s.connect(args.socket)
+
+# Send input as it becomes available, so that interactive pipelines keep working
+def send():
+	while data := sys.stdin.buffer.read1(1 << 16):
+		s.sendall(data)
+	s.shutdown(socket.SHUT_WR)
+
+threading.Thread(target=send, daemon=True).start()
+
+while data := s.recv(1 << 16):
+	sys.stdout.buffer.write(data)
+	sys.stdout.buffer.flush()
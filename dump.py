@@ -1,15 +1,12 @@
 #!/usr/bin/env python3
+import argparse
+import multiprocessing
 import os
-import subprocess
-from pathlib import Path
 import sqlite3
 
 dir = os.path.dirname(__file__)
 os.chdir(dir)
 
-con = sqlite3.connect('katersat.sqlite', isolation_level=None)
-db = con.cursor()
-
 tbls = {
 	'kat_genders': 'gen_code',
 	'kat_languages': 'lang_code',
@@ -19,14 +16,69 @@ tbls = {
 	'kat_wordclasses': 'wc_class',
 }
 
-for t, i in tbls.items():
-	print(t)
+# Large tables, only dumped when asked for, and split into one INSERT per chunk of rows
+bigs = {
+	'kat_lexemes': 'lex_id',
+	'kat_lexeme_attrs': 'lex_id',
+	'glue_lexeme_synonyms': 'lex_id, lex_syn',
+}
+
+
+# Streams a table to data/<t>.sql as multi-row INSERTs, in primary key order, a new INSERT every chunk rows (0 for one INSERT)
+def dump(t, order, chunk):
+	con = sqlite3.connect('file:katersat.sqlite?mode=ro', uri=True)
+	db = con.cursor()
 	fname = f'data/{t}.sql'
-	os.makedirs('data', exist_ok=True)
-	subprocess.run(['rm', '-f', fname])
-	p = subprocess.run(['sqlite3', 'katersat.sqlite', '.mode insert TBL', f'SELECT * FROM {t} ORDER BY {i} ASC;'], capture_output=True, encoding='UTF-8')
-	sql = p.stdout
-	sql = sql.replace(';\nINSERT INTO TBL VALUES', ',\n')
-	sql = sql.replace('INSERT INTO TBL VALUES', f'INSERT INTO {t} VALUES\n')
-	sql = sql.replace(';\n', '\n;\n')
-	Path(fname).write_text(sql, encoding='UTF-8')
+	n = 0
+	with open(fname + '.tmp', 'w', encoding='UTF-8', newline='\n') as out:
+		# SQLite quotes the values itself, which is much faster than doing it row by row in Python
+		cols = [r[1] for r in db.execute(f'PRAGMA table_info({t})')]
+		db.execute("SELECT " + " || ',' || ".join(f'quote({c})' for c in cols) + f" FROM {t} ORDER BY {order} ASC")
+		while rows := db.fetchmany(1000):
+			buf = []
+			for row, in rows:
+				if n == 0 or (chunk and n % chunk == 0):
+					if n:
+						buf.append('\n;\n')
+					buf.append(f'INSERT INTO {t} VALUES\n(')
+				else:
+					buf.append(',\n(')
+				buf.append(row)
+				buf.append(')')
+				n += 1
+			out.write(''.join(buf))
+		if n:
+			out.write('\n;\n')
+	os.replace(fname + '.tmp', fname)
+	con.close()
+	return t, n
+
+
+def dump_args(a):
+	return dump(*a)
+
+
+parser = argparse.ArgumentParser(prog='dump.py', description='Dumps Katersat tables from katersat.sqlite to data/*.sql')
+parser.add_argument('-a', '--all', action='store_true', help='also dump the large tables: ' + ', '.join(bigs))
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of tables to dump at the same time')
+parser.add_argument('-c', '--chunk', type=int, default=5000, help='rows per INSERT in the large tables')
+parser.add_argument('table', nargs='*', help='tables to dump, instead of the default ones')
+args = parser.parse_args()
+
+todo = dict(tbls)
+if args.all:
+	todo.update(bigs)
+if args.table:
+	known = {**tbls, **bigs}
+	for t in args.table:
+		if t not in known:
+			parser.error(f'unknown table {t}')
+	todo = {t: known[t] for t in args.table}
+jobs = [(t, o, args.chunk if t in bigs else 0) for t, o in todo.items()]
+
+os.makedirs('data', exist_ok=True)
+# Largest tables first, so they don't end up running alone at the end
+jobs.sort(key=lambda j: j[0] not in bigs)
+with multiprocessing.get_context('fork').Pool(max(min(args.jobs, len(jobs)), 1)) as pool:
+	for t, n in pool.imap_unordered(dump_args, jobs):
+		print(f'{t}: {n} rows')
@@ -0,0 +1,298 @@
+import regex as re
+import cg
+from katersat import Filter
+
+# Some word classes are different in Katersat
+wc_map_s = {
+	'N': 'T',
+	'V': 'V',
+	'Pali': 'Pali',
+	'Conj': 'Conj',
+	'Adv': 'Adv',
+	'Interj': 'Intj',
+	'Pron': 'Pron',
+	'Prop': 'Prop',
+	'Num': 'Num',
+	'Symbol': 'Symbol',
+	'Adj': 'Adj',
+	'Part': 'Part',
+	'Prep': 'Prep',
+}
+wc_map_k = {v: k for k, v in wc_map_s.items()}
+
+
+# Applies foreign language glosses from Katersat to CG readings
+class Glosser(Filter):
+	stage = 'gloss'
+	unk = True
+
+	# Several languages, as a list or separated by commas, are glossed in one pass
+	def __init__(self, lang='eng', **kw):
+		self.langs = list(dict.fromkeys(lang.split(',') if isinstance(lang, str) else lang))
+		self.lang = self.langs[0]
+		super().__init__(**kw)
+		# How often the fallbacks found a gloss, per span looked up
+		self.stats.update(gram_strip=0, prefix=0, n_pron=0, any_sem=0)
+		# Spans that another reading of the same cohort already has
+		self.stats['shared'] = 0
+
+	# Readings that an earlier stage already glossed are left alone
+	def skip(self, line):
+		return ' <tr-done> ' in line
+
+	def cache_ns(self):
+		return f'glosses:{",".join(self.langs)}:{int(self.trace)}'
+
+	# Semantic classes are mapped from their tags as well as to them
+	def load_maps(self):
+		super().load_maps()
+		self.sem_map_k = self.sem_map
+		self.sem_map_s = {v: k for k, v in self.sem_map_k.items()}
+
+	# Returns the glosses for the candidates of a span, one per language, with '' where there is none
+	def resolve(self, span, found):
+		anas, pfx, s1, s2 = span
+		prefix = ''
+		outs = {}
+
+		for ana in anas:
+			ids = [str(r[0]) for r in found[ana]]
+
+			# Allow looking up morphemes without Gram/[HIT]V
+			if not ids and not ana.startswith('"'):
+				ana = re.sub(r' Gram/[HIT]V ', r' ', ana)
+				ids = [str(r[0]) for r in found[ana]]
+				if ids:
+					self.stats['gram_strip'] += 1
+
+			# If there is a prefix, try without it
+			if not ids and pfx:
+				ana = ana.replace(pfx[0], ' ')
+				ids = [str(r[0]) for r in found[ana]]
+				if ids:
+					prefix = pfx[1]
+					self.stats['prefix'] += 1
+
+			# N may also be Pron, which is rare enough that those candidates are only looked up when needed
+			if not ids and ' N ' in ana and not ' Pron ' in ana:
+				ana = ana.replace(' N ', ' Pron ')
+				anas2 = [ana]
+				for sgpl in ['Sg', 'Pl']:
+					for num in ['', '1', '2', '3', '4']:
+						anas2.append(ana.replace(' Sg', f' {num}{sgpl}'))
+						anas2.append(ana.replace(' Pl', f' {num}{sgpl}'))
+						anas2.append(ana.replace(f' {num}Sg', f' {num}{sgpl}'))
+						anas2.append(ana.replace(f' {num}Pl', f' {num}{sgpl}'))
+				# Many of the replacements make the same candidate
+				anas2 = list(dict.fromkeys(anas2))
+				found2 = self.lk.find_many(anas2, unk=True)
+				for ana in anas2:
+					ids = [str(r[0]) for r in found2[ana]]
+					if ids:
+						self.stats['n_pron'] += 1
+						break
+
+			if ids:
+				todo = [lang for lang in self.langs if lang not in outs]
+				trs = self.glosses(todo, ids, s1, s2)
+
+				# If there were no semantics and we did not find a match, try any semantics
+				if s1 == 'UNK' and (rest := [lang for lang in todo if lang not in trs]):
+					if more := self.glosses(rest, ids):
+						trs.update(more)
+						self.stats['any_sem'] += 1
+
+				for lang, tr in trs.items():
+					wc = wc_map_k[tr[3].capitalize()]
+
+					sem = ''
+					if prefix:
+						sem = ' ' + prefix
+					if tr[1] in self.sem_map_k:
+						sem += ' Sem/'  + self.sem_map_k[tr[1]]
+					if tr[2] in self.sem_map_k:
+						sem += ' Sem/'  + self.sem_map_k[tr[2]]
+
+					out = f'"{tr[0]}"{sem} {wc}'
+					if self.trace:
+						out += f' TR-LEX:{tr[4]}:{tr[5]}'
+					outs[lang] = out
+				if len(outs) == len(self.langs):
+					break
+		return tuple(outs.get(lang, '') for lang in self.langs)
+
+	# Returns {language: (tr_lexeme, tr_semclass, tr_sem2, tr_wordclass, lex_id, tr_id)}, the best gloss in each language of
+	# the first of the lexemes that has one, of lexemes with the given semantics or any
+	def glosses(self, langs, ids, s1=None, s2=None):
+		sql = "SELECT tr_language, tr_lexeme, tr_semclass, tr_sem2, tr_wordclass, lex_id, tr_id FROM kat_best_gloss WHERE tr_language IN (" + ','.join(['?'] * len(langs)) + ") AND lex_id IN (" + ','.join(ids) + ")"
+		args = list(langs)
+		if s1 is not None:
+			sql += " AND lex_semclass = ? AND lex_sem2 = ?"
+			args += [s1, s2]
+		self.db.execute(sql + " ORDER BY lex_id ASC", args)
+		rv = {}
+		for r in self.db.fetchall():
+			rv.setdefault(r[0], r[1:])
+		return rv
+
+	# Returns the glossed readings of a reading, such as '"qimmeq" N Abs Sg Sem/Animal @SUBJ>', as strings without the tab of CG text
+	def gloss_reading(self, reading):
+		return next(self.readings([reading]))
+
+	# As gloss_reading(), for each of the readings in turn, which are processed in batches that share what they look up
+	def gloss_readings(self, readings):
+		return self.readings(readings)
+
+	# Finds the spans of a reading that the memo has results for, and adds the candidates of the others to spans and cands
+	def plan(self, rd, spans, cands, t):
+		hyb = rd.hyb
+		origs = rd.origs
+		scleans = rd.scleans
+		cleans = rd.nosems
+		t = self.prof.lap('gloss/parse', t)
+
+		# Spans are memoised on what their candidates are generated from, as their gloss or ''. Candidates are only generated
+		# for the spans the memo doesn't have, and hits and misses are only counted for the spans that are tried below.
+		keys = {}
+		results = {}
+		for i in range(len(origs)-1):
+			for j in range(len(origs)-1, i, -1):
+				cur = (' '.join(cleans[i:j-1]) + ' ' + ' '.join(scleans[j-1:j])).strip()
+
+				wc, flex = cg.word_class(cleans[j])
+				flex = flex.strip()
+				keys[i, j] = (cur, wc, flex, origs[j-1], hyb)
+				# Another reading of the cohort has the same span
+				if keys[i, j] in spans:
+					self.stats['shared'] += 1
+					continue
+				if (res := self.memo.peek(keys[i, j])) is not None:
+					results[i, j] = res
+					continue
+				ana = (cur + ' ' + wc).strip()
+				#print(f'{i} {j-1}: {cur} | {wc} | {flex}')
+
+				anas = []
+				# Raw match for morpheme sequences
+				anas.append(ana)
+				# First try actual case/flexion
+				if (m := re.match(r'^((?:i?\d?\p{Lu}\p{Ll}[^/\s]* *)+)', flex)) or (m := re.match(r'^(LU)(?: |$)', flex)):
+					flex = re.sub(r'\bi(\p{Lu})', r'\1', m[1])
+					ana2 = f'{ana} {flex}'.strip()
+					anas.append(ana2)
+					if re.search(r' \dPl(O?)$', ana2):
+						anas.append(re.sub(r' (\d)Pl(O?)$', r' \1Sg\2', ana2))
+					anas.append((ana + ' ' + re.sub(r'\b(Rel|Trm|Abl|Lok|Aeq|Ins|Via|Nom|Akk)\b', r'Abs', flex)).strip())
+					if re.search(r'\b\d(Sg|Pl)Poss\b', flex):
+						anas.append((ana + ' ' + re.sub(r'\b\d(Sg|Pl)Poss\b', '', flex)).strip())
+						anas.append((ana + ' ' + re.sub(r'\b(?:Rel|Trm|Abl|Lok|Aeq|Ins|Via|Nom|Akk) (Sg|Pl) \d(Sg|Pl)Poss\b', r'Abs \1', flex)).strip())
+				# Then fall back to baseforms
+				if wc != 'V':
+					anas.append(ana + ' Abs Sg')
+					anas.append(ana + ' Ins Sg')
+					anas.append(ana + ' Abs Pl')
+					anas.append(ana + ' Ins Pl')
+				else:
+					if re.search(r'^.* Gram/[HI]V', ana) or re.search(r'^.* Gram/Refl', ana) or not re.search(r'^.* Gram/TV', ana):
+						anas.append(ana + ' Ind 3Sg')
+						anas.append(ana + ' Ind 3Pl')
+					if re.search(r'^.* Gram/[HT]V', ana) or not re.search(r'^.* Gram/IV', ana):
+						anas.append(ana + ' Ind 3Sg 3SgO')
+						anas.append(ana + ' Ind 3Pl 3PlO')
+						anas.append(ana + ' Ind 3Sg 3PlO')
+						anas.append(ana + ' Ind 3Pl 3SgO')
+
+				if hyb:
+					anas.extend([re.sub(r'^"(\p{Lu}+)" ', r'\1 ', x) for x in anas])
+
+				pfx = re.search(r' (Prefix/[TA]A) ', ana)
+
+				s1 = 'UNK'
+				s2 = 'UNK'
+				if (m := re.search(r'\bi?Sem/(\S+) i?Sem/(\S+)\b', origs[j-1])) and (m[1] in self.sem_map_s) and (m[2] in self.sem_map_s):
+					s1, s2 = self.sem_map_s[m[1]], self.sem_map_s[m[2]]
+					anas = list(map(lambda x: re.sub(fr' \bi?Sem/{m[1]} i?Sem/{m[2]}\b', '', x), anas))
+				elif (m := re.search(r'\bi?Sem/(\S+)\b', origs[j-1])) and (m[1] in self.sem_map_s):
+					s1 = self.sem_map_s[m[1]]
+					anas = list(map(lambda x: re.sub(fr' \bi?Sem/{m[1]}\b', '', x), anas))
+				elif (m := re.search(r'\bi?Sem/(?:an|Be|CognitiveMaking|dur|event|Fem|FirstName|Geo|H|HH|Hprof|Hum|Hunt|inst|Location|LastName|Mailadresse|Mask|ModeOfMovement|Remove|sem|temp|Time|Unit|Url|misse) \bi?Sem/(\S+) i?Sem/(\S+)\b', origs[j-1])) and (m[1] in self.sem_map_s) and (m[2] in self.sem_map_s):
+					s1, s2 = self.sem_map_s[m[1]], self.sem_map_s[m[2]]
+					anas = list(map(lambda x: re.sub(fr' \bi?Sem/{m[1]} i?Sem/{m[2]}\b', '', x), anas))
+				elif (m := re.search(r'\bi?Sem/(?:an|Be|CognitiveMaking|dur|event|Fem|FirstName|Geo|H|HH|Hprof|Hum|Hunt|inst|Location|LastName|Mailadresse|Mask|ModeOfMovement|Remove|sem|temp|Time|Unit|Url|misse) \bi?Sem/(\S+)\b', origs[j-1])) and (m[1] in self.sem_map_s):
+					s1 = self.sem_map_s[m[1]]
+					anas = list(map(lambda x: re.sub(fr' \bi?Sem/{m[1]}\b', '', x), anas))
+
+				#print(f'{i} {j-1}: {cur} | {anas} | {s1} {s2}')
+
+				spans[keys[i, j]] = (anas, pfx, s1, s2)
+				for ana in anas:
+					cands.append(ana)
+					if not ana.startswith('"'):
+						ana = re.sub(r' Gram/[HIT]V ', r' ', ana)
+						cands.append(ana)
+					if pfx:
+						cands.append(ana.replace(pfx[0], ' '))
+
+		self.prof.lap('gloss/candidates', t)
+		return keys, results
+
+	# Resolves the spans of a reading, each at most once per cohort, and returns its output lines without the suffix
+	def finish(self, rd, keys, results, spans, found, resolved):
+		t = self.prof.now()
+		# With several languages, glosses are tagged with theirs, as the spans that have one may differ
+		tags = {lang: f' <tr:{lang}>' if len(self.langs) > 1 else '' for lang in self.langs}
+		# The results of the spans tried so far, one per language
+		tried = {}
+		glossed = []
+		for l, lang in enumerate(self.langs):
+			origs = list(rd.origs)
+
+			# Python doesn't have a real for() loop, so...
+			i = 0
+			e = len(origs)-1
+			while i < e:
+				for j in range(len(origs)-1, i, -1):
+					if (i, j) not in tried:
+						key = keys[i, j]
+						out = self.memo.get(key)
+						if out is None:
+							out = results.get((i, j))
+						if out is None:
+							if key not in resolved:
+								resolved[key] = self.resolve(spans[key], found)
+								self.memo.put(key, resolved[key])
+							out = resolved[key]
+						tried[i, j] = out
+					out = tried[i, j][l]
+
+					if out:
+						origs[i] = f'{out} <tr>{tags[lang]}'
+						k = i+1
+						while k < j:
+							origs[k] = ''
+							k += 1
+						i = j-1
+						break
+
+				i += 1
+			glossed.append(origs)
+
+		t = self.prof.lap('gloss/resolve', t)
+		# Languages that gloss a reading the same way, or not at all, share its output
+		news = []
+		for origs in glossed:
+			tokens = re.sub(r'  +', r' ', ' '.join(origs)).split(' ')
+
+			# Mark semantics before derivation as internal
+			cg.mark_sems(tokens, cg.rx_der_sem_u)
+
+			# Mark word classes before derivation or other word classes as internal
+			cg.mark_wcs(tokens)
+			orig = ' '.join(tokens)
+
+			if orig not in news:
+				news.append(orig)
+
+		self.cache[rd.line] = news
+		self.prof.lap('gloss/output', t)
+		return news
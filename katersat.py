@@ -0,0 +1,808 @@
+import asyncio
+import itertools
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import resource
+import signal
+import sqlite3
+import sys
+import time
+import regex as re
+import cg
+from bloom import Bloom
+from snapshot import Snapshot
+from stats import NoStats, Stats
+from collections import OrderedDict, deque
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stay well below SQLite's limit on the number of bound parameters, which may be as low as 999
+MAX_VARS = 500
+
+# Tables that update.py derives from the others, rather than loading from data.sql
+DERIVED = ['kat_long_raw', 'kat_long_lookup', 'kat_long_prefix', 'kat_best_gloss', 'kat_version']
+
+
+# Fetch map of semantic classes, turning verbal semantic codes into their English equivalent
+def load_sem_map(db):
+	rv = {}
+	db.execute("SELECT sem_code, sem_eng FROM kat_semclasses WHERE sem_code != 'UNK' AND sem_code NOT LIKE 'V.%'")
+	while row := db.fetchone():
+		rv[row[0]] = row[0]
+	db.execute("SELECT sem_code, sem_eng FROM kat_semclasses WHERE sem_code LIKE 'V.%'")
+	while row := db.fetchone():
+		m = re.match(r'^:([^\s,]+)', row[1])
+		if m[1] in rv:
+			rv[row[0]] = 'v'+m[1]
+		else:
+			rv[row[0]] = m[1]
+	return rv
+
+
+rx_gram_v = re.compile(r'Gram/[HIT]V')
+# Tokens that a span of morphemes can be followed by in a candidate: the first token of the next morpheme, or a word class
+rx_span_end = re.compile(r'(?:i?(?:' + cg.WCS + r'))|(?:\p{Lu}[_\p{Lu}]+)|U|')
+
+
+# The key of a sequence of tokens for prefix pruning. It leaves out what candidate generation may remove, so that every
+# candidate a span can produce has the key of the span as the key of one of its prefixes.
+def prefix_key(tokens):
+	return ' '.join(t.strip('"') for t in tokens if not rx_gram_v.fullmatch(t))
+
+
+# The keys of the prefixes of an analysis that a span of morphemes could match
+def prefix_keys(ana):
+	ts = ana.split(' ')
+	return {prefix_key(ts[:k]) for k in range(1, len(ts)) if rx_span_end.fullmatch(ts[k])}
+
+
+# Exact-match lookups of analyses in kat_long_raw, straight from SQLite. Most candidates are not analyses, so those that
+# were already looked up and not found are not asked for again, nor are those that the Bloom filter in katersat.bloom rules out.
+class Lookup:
+	def __init__(self, con, bloom=None, absent_size=100000):
+		self.db = con.cursor()
+		self.memo = None
+		self.bloom = bloom
+		self.absent = Memo(absent_size)
+		self.stats = {
+			# Candidates that were already asked for in the same lookup
+			'dupes': 0,
+			# Candidates the Bloom filter ruled out
+			'bloom': 0,
+			'statements': 0,
+			# Statements that would have been run without the above and the absent cache
+			'statements_saved': 0,
+		}
+
+	# Keep the rows of every analysis looked up from now on, for stages that look up the same analyses, until forget()
+	def remember(self):
+		self.memo = {}
+
+	def forget(self):
+		if self.memo:
+			self.memo = {}
+
+	# Returns [(lex_id, let_attrs), ...] for lexemes whose analysis is exactly ana
+	def find(self, ana, unk=False):
+		return self.find_many([ana], unk)[ana]
+
+	# As find(), but for many analyses at once, returning {ana: [(lex_id, let_attrs), ...]}
+	def find_many(self, anas, unk=False):
+		return {ana: [(r[0], r[1]) for r in rows if unk or not r[2]] for ana, rows in self.rows(anas).items()}
+
+	# Returns {ana: [(lex_id, let_attrs, is_unk), ...]}, probing kat_long_lookup for the exact analyses in as few statements as possible
+	def rows(self, anas):
+		rv = {}
+		todo = {}
+		asked = 0
+		for ana in anas:
+			if ana in rv:
+				self.stats['dupes'] += 1
+				continue
+			if self.memo and ana in self.memo:
+				rv[ana] = self.memo[ana]
+				continue
+			asked += 1
+			if self.absent.get(ana):
+				rv[ana] = []
+			elif self.bloom and ana not in self.bloom:
+				self.stats['bloom'] += 1
+				self.absent.put(ana, True)
+				rv[ana] = []
+			else:
+				todo[ana] = rv[ana] = []
+		keys = list(todo)
+		statements = (len(keys) + MAX_VARS - 1) // MAX_VARS
+		self.stats['statements'] += statements
+		self.stats['statements_saved'] += (asked + MAX_VARS - 1) // MAX_VARS - statements
+		for k in range(0, len(keys), MAX_VARS):
+			chunk = keys[k:k+MAX_VARS]
+			self.db.execute("SELECT fst_ana, lex_id, let_attrs, lex_semclass FROM kat_long_lookup WHERE fst_ana IN (" + ','.join(['?'] * len(chunk)) + ") ORDER BY fst_ana ASC, lex_id ASC, seq ASC", chunk)
+			while r := self.db.fetchone():
+				todo[r[0]].append((r[1], r[2], r[3] == 'UNK'))
+		for ana, rows in todo.items():
+			if not rows:
+				self.absent.put(ana, True)
+		if self.memo is not None:
+			self.memo.update(todo)
+		return rv
+
+	# Returns [(lex_semclass, lex_sem2, lex_id), ...] for the given lexemes that have semantics
+	def sems(self, ids):
+		self.db.execute("SELECT DISTINCT lex_semclass, lex_sem2, lex_id FROM kat_lexemes WHERE lex_id IN (" + ','.join(map(str, ids)) + ") AND lex_semclass != 'UNK'")
+		return self.db.fetchall()
+
+	# Returns the subset of the given prefix keys that some analysis has
+	def prefixes(self, keys):
+		rv = set()
+		keys = list(keys)
+		for k in range(0, len(keys), MAX_VARS):
+			chunk = keys[k:k+MAX_VARS]
+			self.db.execute("SELECT DISTINCT prefix FROM kat_long_prefix WHERE prefix IN (" + ','.join(['?'] * len(chunk)) + ")", chunk)
+			rv.update(r[0] for r in self.db.fetchall())
+		return rv
+
+
+# Loads kat_long_lookup once, so that every lookup is a dict probe
+class IndexLookup(Lookup):
+	def __init__(self, con):
+		super().__init__(con)
+		t = time.perf_counter()
+		rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+		self.anas = {}
+		self.lexs = {}
+		self.db.execute("SELECT fst_ana, lex_id, lex_semclass, lex_sem2, let_attrs FROM kat_long_lookup ORDER BY lex_id ASC, seq ASC")
+		while r := self.db.fetchone():
+			self.anas.setdefault(r[0], []).append((r[1], r[4], r[2] == 'UNK'))
+			self.lexs[r[1]] = (r[2], r[3])
+		self.db.execute("SELECT DISTINCT prefix FROM kat_long_prefix")
+		self.prefix_set = {r[0] for r in self.db.fetchall()}
+
+		self.load_time = time.perf_counter() - t
+		# ru_maxrss is in KiB on Linux
+		self.load_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss, 0) * 1024
+
+	def find(self, ana, unk=False):
+		return [(r[0], r[1]) for r in self.anas.get(ana, ()) if unk or not r[2]]
+
+	def find_many(self, anas, unk=False):
+		return {ana: self.find(ana, unk) for ana in dict.fromkeys(anas)}
+
+	def rows(self, anas):
+		return {ana: self.anas.get(ana, []) for ana in dict.fromkeys(anas)}
+
+	def sems(self, ids):
+		rv = set()
+		for id in ids:
+			sem = self.lexs.get(int(id))
+			if sem and sem[0] != 'UNK':
+				rv.add((sem[0], sem[1], int(id)))
+		return list(rv)
+
+	def prefixes(self, keys):
+		return {k for k in keys if k in self.prefix_set}
+
+	def info(self):
+		return f'Index: {len(self.anas)} analyses of {len(self.lexs)} lexemes loaded in {self.load_time:.2f}s, ~{self.load_rss / 1048576:.1f} MiB'
+
+
+# Lookups in a memory-mapped katersat.snap, as written by update.py, which needs no loading and is shared between processes
+class MmapLookup(Lookup):
+	def __init__(self, con, snap):
+		super().__init__(con)
+		self.snap = snap
+
+	def find(self, ana, unk=False):
+		return [(r[0], r[1]) for r in self.snap.rows(ana) if unk or not r[2]]
+
+	def find_many(self, anas, unk=False):
+		return {ana: self.find(ana, unk) for ana in dict.fromkeys(anas)}
+
+	def rows(self, anas):
+		return {ana: self.snap.rows(ana) for ana in dict.fromkeys(anas)}
+
+	def sems(self, ids):
+		rv = set()
+		for id in ids:
+			sem = self.snap.lexeme(int(id))
+			if sem and sem[0] != 'UNK':
+				rv.add((sem[0], sem[1], int(id)))
+		return list(rv)
+
+	def prefixes(self, keys):
+		return {k for k in keys if self.snap.has_prefix(k)}
+
+
+# Opens a file that update.py writes next to katersat.sqlite, such as katersat.snap as a Snapshot, if it is there and
+# of the data version of the katersat.sqlite that is in use
+def open_mapped(dir, cls, name, label, version):
+	try:
+		f = cls(f'{dir}/{name}')
+	except (OSError, ValueError) as e:
+		print(f'Warning: Not using the {label}: {e}', file=sys.stderr)
+		return None
+	if f.version != version:
+		print(f'Warning: Not using the {label}, as it is not of the current katersat.sqlite', file=sys.stderr)
+		f.close()
+		return None
+	return f
+
+
+# Opens katersat-serving.sqlite, the copy of katersat.sqlite that update.py tunes for lookups, if it is there and of the
+# data version in use. It is never changed in place, so it is opened immutable, which spares SQLite locking and checking the file.
+def open_serving(dir, version, mmap_size=0):
+	path = dir + '/katersat-serving.sqlite'
+	if not os.path.exists(path):
+		return None
+	con = sqlite3.connect('file:' + path + '?mode=ro&immutable=1', uri=True, isolation_level=None, check_same_thread=False)
+	try:
+		serving = data_version(con)
+	except (sqlite3.Error, OSError) as e:
+		print(f'Warning: Not using {path}: {e}', file=sys.stderr)
+		con.close()
+		return None
+	if serving != version:
+		print(f'Warning: Not using {path}, as it is not of the current katersat.sqlite', file=sys.stderr)
+		con.close()
+		return None
+	con.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+	return con
+
+
+def lookup(con, index=False, snap=None, bloom=None, absent_size=100000):
+	if snap:
+		return MmapLookup(con, snap)
+	if index:
+		return IndexLookup(con)
+	return Lookup(con, bloom, absent_size)
+
+
+# The version of the Katersat data in a database, which update.py writes into it along with the data, so that the two
+# always go together. A database that update.py did not version is known by when its file was last changed.
+def data_version(con):
+	try:
+		return con.execute("SELECT version FROM kat_version").fetchone()[0]
+	except (sqlite3.Error, TypeError):
+		st = os.stat(con.execute("PRAGMA database_list").fetchone()[2])
+		return f'{st.st_mtime_ns}:{st.st_size}'
+
+
+# Parses a cache size, which is a number of entries or a number of bytes if it ends in K, M, or G
+def cache_size(v):
+	units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+	if v[-1:].upper() in units:
+		return ('bytes', int(v[:-1]) * units[v[-1:].upper()])
+	return ('entries', int(v))
+
+
+# Parses a number of bytes, which may end in K, M, or G
+def byte_size(v):
+	return cache_size(v)[1]
+
+
+# Least recently used cache of processed readings, bounded by number of entries or approximate size in bytes.
+# With a path, the cache is loaded from and saved to an SQLite file, and thrown away if the Katersat data changed since.
+class Cache:
+	def __init__(self, size=('entries', 20000), path=None, ns='', version=''):
+		self.unit, self.max = size
+		self.path = path
+		self.ns = ns
+		self.version = version
+		self.data = OrderedDict()
+		self.bytes = 0
+		self.evicted = 0
+		if path:
+			self.load()
+			self.evicted = 0
+
+	def _size(self, key, val):
+		if isinstance(val, str):
+			return len(key) + len(val)
+		return len(key) + sum(len(v) for v in val)
+
+	def __len__(self):
+		return len(self.data)
+
+	def __contains__(self, key):
+		return key in self.data
+
+	def __getitem__(self, key):
+		self.data.move_to_end(key)
+		return self.data[key]
+
+	def __setitem__(self, key, val):
+		if key in self.data:
+			self.bytes -= self._size(key, self.data[key])
+		self.data[key] = val
+		self.data.move_to_end(key)
+		self.bytes += self._size(key, val)
+		while self.data and (len(self.data) if self.unit == 'entries' else self.bytes) > self.max:
+			k, v = self.data.popitem(last=False)
+			self.bytes -= self._size(k, v)
+			self.evicted += 1
+
+	def _open(self):
+		con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+		con.execute("CREATE TABLE IF NOT EXISTS cache_versions (ns TEXT NOT NULL, version TEXT NOT NULL, PRIMARY KEY (ns))")
+		con.execute("CREATE TABLE IF NOT EXISTS cache_entries (ns TEXT NOT NULL, key TEXT NOT NULL, val TEXT NOT NULL, PRIMARY KEY (ns, key))")
+		return con
+
+	def load(self):
+		con = self._open()
+		row = con.execute("SELECT version FROM cache_versions WHERE ns = ?", [self.ns]).fetchone()
+		if row and row[0] == self.version:
+			for k, v in con.execute("SELECT key, val FROM cache_entries WHERE ns = ? ORDER BY rowid ASC", [self.ns]):
+				self[k] = json.loads(v)
+		con.close()
+
+	# Merges the entries into the file, so that several processes can share it, and then trims it to size, oldest first
+	def save(self):
+		if not self.path:
+			return
+		con = self._open()
+		con.execute("BEGIN IMMEDIATE")
+		row = con.execute("SELECT version FROM cache_versions WHERE ns = ?", [self.ns]).fetchone()
+		if not row or row[0] != self.version:
+			con.execute("DELETE FROM cache_entries WHERE ns = ?", [self.ns])
+			con.execute("INSERT OR REPLACE INTO cache_versions VALUES (?, ?)", [self.ns, self.version])
+		con.executemany("INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?)", ((self.ns, k, json.dumps(v, ensure_ascii=False)) for k, v in self.data.items()))
+		if self.unit == 'entries':
+			con.execute("DELETE FROM cache_entries WHERE ns = ? AND rowid NOT IN (SELECT rowid FROM cache_entries WHERE ns = ? ORDER BY rowid DESC LIMIT ?)", [self.ns, self.ns, self.max])
+		else:
+			con.execute("DELETE FROM cache_entries WHERE rowid IN (SELECT rowid FROM (SELECT rowid, SUM(length(key) + length(val)) OVER (ORDER BY rowid DESC) AS total FROM cache_entries WHERE ns = ?) WHERE total > ?)", [self.ns, self.max])
+		con.execute("COMMIT")
+		con.close()
+
+
+# A bounded memo of the results of spans of morphemes, which recur across the readings of a cohort and across a corpus
+# even when whole readings don't. Least recently used entries go first, bounded by number of entries.
+class Memo(Cache):
+	def __init__(self, size=100000):
+		super().__init__(('entries', size))
+		self.hits = 0
+		self.misses = 0
+
+	def _size(self, key, val):
+		return 0
+
+	# Returns the result for a key, or None, without counting it as a hit or a miss
+	def peek(self, key):
+		return self.data.get(key)
+
+	# Returns the result for a key, or None
+	def get(self, key):
+		val = self.data.get(key)
+		if val is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.data.move_to_end(key)
+		return val
+
+	def put(self, key, val):
+		self[key] = val
+
+
+# Maps fn over items in a process pool, yielding the results in input order as soon as they are ready,
+# with at most ahead items in flight so that input is not read any faster than it is processed
+def pool_map(pool, fn, items, ahead):
+	pending = deque()
+	for item in items:
+		pending.append(pool.apply_async(fn, (item,)))
+		while pending and (len(pending) >= ahead or pending[0].ready()):
+			yield pending.popleft().get()
+	while pending:
+		yield pending.popleft().get()
+
+
+def _stat(fn):
+	st = os.stat(fn)
+	return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+# Serves a line filter over a Unix socket to any number of concurrent clients, until SIGINT or SIGTERM.
+# Each client streams CG input, half-closes its end when done, and gets the output in order as it is produced.
+# When the watched database is replaced, as update.py does by renaming a new one into place, reload() is called.
+def serve(path, process, reload, watch, interval=1.0):
+	async def client(reader, writer):
+		try:
+			while line := await reader.readline():
+				outs = process(line.decode('UTF-8'))
+				writer.write(''.join(out + '\n' for out in outs).encode('UTF-8'))
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def watcher():
+		st = _stat(watch)
+		while True:
+			await asyncio.sleep(interval)
+			try:
+				cur = _stat(watch)
+			except FileNotFoundError:
+				continue
+			if cur != st:
+				print(f'Reloading {watch}', file=sys.stderr)
+				reload()
+				st = cur
+
+	async def main():
+		stop = asyncio.Event()
+		loop = asyncio.get_running_loop()
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(sig, stop.set)
+		if os.path.exists(path):
+			os.unlink(path)
+		server = await asyncio.start_unix_server(client, path, limit=1 << 24)
+		task = asyncio.create_task(watcher())
+		await stop.wait()
+		task.cancel()
+		server.close()
+		os.unlink(path)
+
+	asyncio.run(main())
+
+
+# Base of what runs over a CG stream, from the command line with run() or as a library: a filter, or a pipeline of them
+class Stream:
+	def __init__(self, dir=DIR, cohorts=False):
+		self.dir = dir
+		self.cohorts = cohorts
+		self.prof = NoStats()
+
+	# Times the stages of processing readings from now on
+	def set_stats(self, prof):
+		self.prof = prof
+
+	# Returns the output of each line of input, as a list per line. The lines are processed together, as the readings of a
+	# cohort are. They are text, or cg.Readings that another stage or cg.read_json() already split, and output readings are
+	# cg.Readings.
+	def process_each(self, lines):
+		raise NotImplementedError
+
+	# As process_each(), but as one list
+	def process_lines(self, lines):
+		return [out for outs in self.process_each(lines) for out in outs]
+
+	# Returns the output lines for one input line
+	def process(self, line):
+		return [cg.text(out) for out in self.process_lines([line])]
+
+	# Returns the output lines for the lines of one cohort, as grouped by cg.cohorts()
+	def process_cohort(self, lines):
+		return [cg.text(out) for out in self.process_lines(lines)]
+
+	# As process_lines(), timing the lines as a reading, or as a cohort with --cohorts
+	def process_timed(self, lines):
+		t = self.prof.begin()
+		outs = self.process_lines(lines)
+		if self.cohorts:
+			self.prof.end_cohort(lines, t)
+		else:
+			self.prof.end(lines[0], t)
+		return outs
+
+	# For use as a library: yields the output readings of each reading in turn, as a list of strings without the tab of CG
+	# text. Readings are processed size at a time, as a cohort is, so that the spans they share are resolved once.
+	def readings(self, readings, size=1000):
+		readings = iter(readings)
+		while batch := ['\t' + rd.lstrip('\t') for rd in itertools.islice(readings, size)]:
+			for outs in self.process_each(batch):
+				yield [cg.text(out)[1:] for out in outs]
+
+	# Returns the output for a block of lines as lines of text, or as fmt() formats them
+	def process_block(self, lines, fmt=cg.text):
+		process = self.process_timed if isinstance(self.prof, Stats) else self.process_lines
+		groups = cg.cohorts(lines) if self.cohorts else ([line] for line in lines)
+		return [fmt(out) for group in groups for out in process(group)]
+
+
+# Base of the stream filters, which own a read-only connection to katersat.sqlite, its lookups and maps, and a cache of processed readings
+class Filter(Stream):
+	# The prefix of the stages of the filter in the --stats output
+	stage = 'filter'
+	# Whether lookups also find the analyses that are only known as unknown words
+	unk = False
+
+	def __init__(self, dir=DIR, index=False, mmap=False, trace=False, cache_size=('entries', 20000), cache_file=None, span_cache_size=100000, absent_cache_size=100000, bloom=False, sqlite_mmap=256 << 20, cohorts=False, share=None, report=False):
+		super().__init__(dir, cohorts)
+		self.index = index
+		self.mmap = mmap
+		self.con = None
+		self.snap = None
+		self.bloom = bloom
+		self.bloom_filter = None
+		self.absent_cache_size = absent_cache_size
+		self.sqlite_mmap = sqlite_mmap
+		self.trace = trace
+		# Whether to say on stderr what loading the index cost, as --stats asks for
+		self.report = report
+		self.cache_size = cache_size
+		# An empty cache file means the default next to katersat.sqlite
+		if cache_file == '':
+			cache_file = dir + '/katersat-cache.sqlite'
+		self.cache_file = cache_file
+		self.stats = {
+			'hit': 0,
+			'miss': 0,
+		}
+		# The filter whose connection and lookups this one uses, which reload() uses again
+		self.shared = share
+		if share:
+			self.share(share)
+		else:
+			self.connect()
+			self.load_maps()
+		self.cache = self.open_cache()
+		self.memo = Memo(span_cache_size)
+
+	# Cached readings are only valid for the same data and for options that affect the output
+	def cache_ns(self):
+		return ''
+
+	def open_cache(self):
+		return Cache(self.cache_size, self.cache_file, self.cache_ns(), self.version)
+
+	# Worker processes inherit everything but must not share the SQLite connection; an index or a mapped snapshot can be shared as is
+	def connect(self, worker=False):
+		# A forked worker leaves the connection it inherited to the main process
+		if self.con and not worker:
+			self.con.close()
+		# The files update.py writes may be replaced at any moment, so only those of the same data as katersat.sqlite are used
+		con = sqlite3.connect('file:' + self.dir + '/katersat.sqlite?mode=ro', uri=True, isolation_level=None, check_same_thread=False)
+		self.version = data_version(con)
+		self.con = open_serving(self.dir, self.version, self.sqlite_mmap)
+		if self.con:
+			con.close()
+		else:
+			self.con = con
+		self.db = self.con.cursor()
+		self.prof.watch(self.con)
+		if worker and (self.index or self.snap):
+			self.lk.db = self.con.cursor()
+			return
+		if self.snap:
+			self.snap.close()
+		if self.bloom_filter:
+			self.bloom_filter.close()
+		self.snap = open_mapped(self.dir, Snapshot, 'katersat.snap', 'snapshot', self.version) if self.mmap else None
+		# Only lookups in SQLite need the Bloom filter
+		self.bloom_filter = open_mapped(self.dir, Bloom, 'katersat.bloom', 'Bloom filter', self.version) if self.bloom and not (self.index or self.snap) else None
+		self.lk = lookup(self.con, self.index, self.snap, self.bloom_filter, self.absent_cache_size)
+		if self.report and self.index and not self.snap:
+			print(self.lk.info(), file=sys.stderr)
+
+	# The snapshot has its own copy of the semantic class map, so that lookups need no SQLite at all
+	def load_maps(self):
+		if self.snap:
+			self.sem_map = self.snap.sem_map
+		else:
+			self.sem_map = load_sem_map(self.db)
+
+	# Uses the connection and lookups of another filter, for stages that run in the same process
+	def share(self, other):
+		self.con = other.con
+		self.db = other.db
+		self.version = other.version
+		self.lk = other.lk
+		self.snap = other.snap
+		self.bloom_filter = other.bloom_filter
+		self.load_maps()
+
+	# Picks up a replaced katersat.sqlite, which may come with different semantic classes, and starts over with an empty cache
+	def reload(self):
+		if self.shared:
+			self.share(self.shared)
+		else:
+			self.connect()
+			self.load_maps()
+		self.cache = self.open_cache()
+		self.memo = Memo(self.memo.max)
+
+	def save(self):
+		self.cache.save()
+
+	# Saves the cache and lets go of the database, for a filter used as a library
+	def close(self):
+		self.save()
+		self.con.close()
+		if self.snap:
+			self.snap.close()
+			self.snap = None
+		if self.bloom_filter:
+			self.bloom_filter.close()
+			self.bloom_filter = None
+
+	def get_stats(self):
+		lookup = dict(self.lk.stats, absent_hit=self.lk.absent.hits)
+		return dict(self.stats, evict=self.cache.evicted, span_hit=self.memo.hits, span_miss=self.memo.misses, lookup=lookup)
+
+	def set_stats(self, prof):
+		super().set_stats(prof)
+		prof.watch(self.con)
+
+	# Whether a line is passed through as it is, even if it is a reading
+	def skip(self, line):
+		return False
+
+	# A span that several readings have is resolved once, and the candidates of all of them are looked up in one go, between
+	# each reading's plan() and finish(). Other lines are passed through, in the order of the input.
+	def process_each(self, lines):
+		rv = []
+		# The readings that are not cached, with what plan() found, and then their output
+		todo = {}
+		# The spans that need resolving, by memo key, with their candidates
+		spans = {}
+		cands = []
+		for line in lines:
+			t = self.prof.now()
+			# Readings from the tagger of a Pipeline, or read with --in-format json, are already split
+			if isinstance(line, cg.Reading):
+				rd = line
+				if self.skip(rd.line + rd.suffix):
+					rv.append([rd])
+					continue
+			else:
+				line = line.rstrip()
+				if self.skip(line) or not cg.is_reading(line):
+					rv.append([line])
+					continue
+				rd = cg.Reading(line)
+			if rd.line in self.cache:
+				self.stats['hit'] += 1
+				self.prof.lap(f'{self.stage}/cache', t)
+				rv.append([cg.Reading.split(out, rd.suffix) for out in self.cache[rd.line]])
+				continue
+			# The same reading again, but with a different suffix, is as good as cached
+			if rd.line in todo:
+				self.stats['hit'] += 1
+			else:
+				self.stats['miss'] += 1
+				todo[rd.line] = self.plan(rd, spans, cands, t)
+			rv.append(rd)
+
+		if todo:
+			t = self.prof.now()
+			# Finding matching analyses as its own step is 3 orders of magnitude faster
+			found = self.lk.find_many(cands, unk=self.unk) if cands else {}
+			self.prof.lap(f'{self.stage}/lookup', t)
+			resolved = {}
+			for k, rd in enumerate(rv):
+				if isinstance(rd, cg.Reading):
+					if isinstance(todo[rd.line], tuple):
+						todo[rd.line] = self.finish(rd, *todo[rd.line], spans, found, resolved)
+					rv[k] = [cg.Reading.split(out, rd.suffix) for out in todo[rd.line]]
+		return rv
+
+
+
+# Command line options shared by all the filters
+def add_arguments(parser):
+	parser.add_argument('-t', '--trace', action='store_true')
+	parser.add_argument('-i', '--index', action='store_true', help='preload kat_long_raw into memory instead of querying SQLite for every analysis')
+	parser.add_argument('-m', '--mmap', action='store_true', help='look analyses up in the memory-mapped katersat.snap written by update.py, falling back to SQLite if it is missing or stale')
+	parser.add_argument('--cache-size', type=cache_size, default='20000', help='number of readings to cache, or size in bytes with a K, M, or G suffix')
+	parser.add_argument('--cache-file', nargs='?', const='', help='keep the cache in this SQLite file between runs (default: katersat-cache.sqlite next to katersat.sqlite)')
+	parser.add_argument('--span-cache-size', type=int, default=100000, help='number of spans of morphemes whose results are kept for other readings (0 to disable)')
+	parser.add_argument('--absent-cache-size', type=int, default=100000, help='number of analyses that were looked up in SQLite and not found to remember, so that they are not asked for again (0 to disable)')
+	parser.add_argument('--bloom', action='store_true', help='rule out analyses with the Bloom filter in katersat.bloom written by update.py before asking SQLite for them, which saves most statements but costs about as much CPU as it saves while katersat.sqlite is in the page cache')
+	parser.add_argument('--sqlite-mmap', type=byte_size, default='256M', help='bytes of katersat-serving.sqlite to memory-map, with a K, M, or G suffix (default: 256M, 0 to read it instead)')
+	parser.add_argument('-c', '--cohorts', action='store_true', help='process the readings of each cohort together, so that spans they share are resolved once; a cohort is output once the line after it is read (not with --serve)')
+	parser.add_argument('--in-format', choices=['cg', 'json'], default='cg', help='read CG text, or the JSON lines of --out-format json, as from cg-json.py')
+	parser.add_argument('--out-format', choices=['cg', 'json'], default='cg', help='write CG text, or JSON lines with readings already split into morphemes and suffix, for a following stage to read with --in-format json')
+	parser.add_argument('-u', '--unbuffered', action='store_true', help='flush output after every line, instead of at CG stream boundaries')
+	parser.add_argument('--flush-delay', type=float, default=1.0, help='seconds buffered output may wait before it is flushed anyway (default: 1.0, 0 to disable)')
+	parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes to spread the input over; output stays in input order')
+	parser.add_argument('--stats', nargs='?', const='-', metavar='FILE', help='write counters and timing histograms of each stage as JSON lines to stderr or this file, every --stats-interval seconds, on SIGUSR1, and at the end; with -i, also say on stderr what loading the index cost')
+	parser.add_argument('--stats-interval', type=float, default=60.0, help='seconds between --stats reports (default: 60, 0 for only on SIGUSR1 and at the end)')
+	parser.add_argument('--slow-log', metavar='FILE', help='write readings that take longer than --slow-ms to this file as JSON lines, with the time of each stage')
+	parser.add_argument('--slow-ms', type=float, default=100.0, help='threshold for --slow-log in milliseconds (default: 100)')
+	parser.add_argument('--serve', metavar='SOCKET', help='keep running and serve clients (see client.py) on this Unix socket, reloading katersat.sqlite when it is replaced')
+
+
+# Options of add_arguments() that Filter takes
+def filter_options(args):
+	return {
+		'index': args.index,
+		'mmap': args.mmap,
+		'trace': args.trace,
+		'cache_size': args.cache_size,
+		'cache_file': args.cache_file,
+		'span_cache_size': args.span_cache_size,
+		'absent_cache_size': args.absent_cache_size,
+		'bloom': args.bloom,
+		'sqlite_mmap': args.sqlite_mmap,
+		'cohorts': args.cohorts,
+		'report': args.stats is not None,
+	}
+
+
+_worker = None
+_fmt = cg.text
+
+def _init_worker():
+	# Only the main process reports stats
+	signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+	_worker.connect(worker=True)
+	# Each worker saves its own part of the cache when the pool is closed
+	multiprocessing.util.Finalize(None, _worker.save, exitpriority=10)
+
+def _process_block(lines):
+	outs = _worker.process_block(lines, _fmt)
+	# Stats are counted in the workers, so they are sent back along with each block
+	if isinstance(_worker.prof, Stats):
+		return outs, (os.getpid(), _worker.get_stats(), _worker.prof.take())
+	return outs, None
+
+
+# Runs a filter from the command line: as a server, as a pool of workers, or straight from stdin to stdout
+def run(filt, args):
+	global _worker, _fmt
+
+	prof = None
+	if args.stats is not None or args.slow_log:
+		prof = Stats(args.stats, args.slow_log, args.slow_ms)
+		filt.set_stats(prof)
+	process = filt.process_timed if prof else filt.process_lines
+	parse = cg.read_json if args.in_format == 'json' else str
+	_fmt = fmt = cg.write_json if args.out_format == 'json' else cg.text
+
+	if args.serve:
+		done = _report(prof, args, filt.get_stats)
+		serve(args.serve, lambda line: [fmt(out) for out in process([parse(line)])], filt.reload, filt.dir + '/katersat.sqlite')
+		filt.save()
+		_report_end(prof, args, done, filt.get_stats())
+		return
+
+	# The pool must be forked before the output's flush timer thread is started
+	pool = None
+	if args.jobs > 1:
+		_worker = filt
+		pool = multiprocessing.get_context('fork').Pool(args.jobs, _init_worker)
+
+	output = cg.Output(sys.stdout, args.unbuffered, args.flush_delay)
+	# With workers, the counters are summed from what they sent
+	counters = (lambda: None) if pool else filt.get_stats
+	done = _report(prof, args, counters)
+
+	lines = sys.stdin if args.in_format == 'cg' else map(parse, sys.stdin)
+	if pool:
+		for outs, st in pool_map(pool, _process_block, cg.blocks(lines), args.jobs * 4):
+			if st:
+				prof.merge(*st)
+			for out in outs:
+				output.write(out)
+		pool.close()
+		pool.join()
+	else:
+		groups = cg.cohorts(lines) if args.cohorts else ([line] for line in lines)
+		for group in groups:
+			for out in process(group):
+				output.write(fmt(out))
+		filt.save()
+
+	output.close()
+	_report_end(prof, args, done, counters())
+
+
+# Starts reporting stats periodically and on SIGUSR1, if they were asked for
+def _report(prof, args, counters):
+	if not prof or args.stats is None:
+		return None
+	signal.signal(signal.SIGUSR1, lambda signum, frame: prof.dump(counters()))
+	if args.stats_interval > 0:
+		return prof.every(args.stats_interval, counters)
+	return None
+
+
+def _report_end(prof, args, done, counters):
+	if not prof or args.stats is None:
+		return
+	if done:
+		done.set()
+	prof.dump(counters, final=True)
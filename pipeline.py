@@ -0,0 +1,59 @@
+from katersat import DIR, Stream
+from tagger import SemTagger
+from glosser import Glosser
+
+
+# Runs SemTagger and then Glosser over each line in one process, with the same output as piping apply-sems.py into gloss.py.
+# Both stages share one connection, and the glosser reuses the rows of the analyses the tagger already looked up for the line.
+class Pipeline(Stream):
+	def __init__(self, last=False, max_readings=0, lang='eng', **kw):
+		super().__init__(kw.get('dir', DIR), kw.get('cohorts', False))
+		self.tagger = SemTagger(last=last, max_readings=max_readings, **kw)
+		self.glosser = Glosser(lang=lang, share=self.tagger, **kw)
+		self.tagger.lk.remember()
+
+	def connect(self, worker=False):
+		self.tagger.connect(worker)
+		self.glosser.share(self.tagger)
+		self.tagger.lk.remember()
+
+	def reload(self):
+		self.tagger.reload()
+		self.glosser.reload()
+		self.tagger.lk.remember()
+
+	def save(self):
+		self.tagger.save()
+		self.glosser.save()
+
+	def close(self):
+		self.glosser.save()
+		self.tagger.close()
+
+	def set_stats(self, prof):
+		super().set_stats(prof)
+		self.tagger.set_stats(prof)
+		# Not set_stats(), which would count the statements on the shared connection twice
+		self.glosser.prof = prof
+
+	def get_stats(self):
+		gloss = self.glosser.get_stats()
+		# The glosser's lookups are the tagger's
+		del gloss['lookup']
+		return {'sems': self.tagger.get_stats(), 'gloss': gloss}
+
+	# The readings the tagger outputs for a cohort are glossed together as well, as they are, without parsing them again
+	def process_each(self, lines):
+		tagged = self.tagger.process_each(lines)
+		glossed = iter(self.glosser.process_each([out for outs in tagged for out in outs]))
+		self.tagger.lk.forget()
+		# The glosses of the readings the tagger made of each line
+		return [[out for _ in outs for out in next(glossed)] for outs in tagged]
+
+	# Returns the tagged and glossed readings of a reading, as strings without the tab of CG text
+	def annotate_reading(self, reading):
+		return next(self.readings([reading]))
+
+	# As annotate_reading(), for each of the readings in turn
+	def annotate_readings(self, readings):
+		return self.readings(readings)
@@ -146,6 +146,54 @@ CREATE INDEX kat_long_raw_lex_id ON kat_long_raw (lex_id);
 CREATE INDEX kat_long_raw_fst_ana ON kat_long_raw (substr(fst_ana,1,16));
 
 
+-- kat_long_raw with what the lookups need from kat_lexemes and kat_lexeme_attrs, built by update.py
+-- Keyed on the full analysis, so lookups are exact probes without joins. seq numbers the analyses of each lexeme in the order
+-- update.py generated them, so rows come out in the same order as a full build of kat_long_raw has them, even after incremental updates.
+CREATE TABLE kat_long_lookup (
+	fst_ana TEXT NOT NULL,
+	lex_id INTEGER NOT NULL,
+	seq INTEGER NOT NULL,
+	lex_semclass TEXT NOT NULL,
+	lex_sem2 TEXT NOT NULL,
+	let_attrs INTEGER NOT NULL,
+
+	PRIMARY KEY (fst_ana, lex_id, seq)
+) WITHOUT ROWID;
+
+
+-- Keys of the morpheme-sequence prefixes of the analyses in kat_long_lookup, built by update.py with katersat.prefix_keys()
+-- apply-sems.py stops extending a span once no analysis has a prefix with its key
+CREATE TABLE kat_long_prefix (
+	prefix TEXT NOT NULL,
+	lex_id INTEGER NOT NULL,
+
+	PRIMARY KEY (prefix, lex_id)
+) WITHOUT ROWID;
+
+
+-- The best translation of each Greenlandic lexeme into each language, as ranked by synonym order, built by update.py
+-- The lexeme's own semantics are kept so that lookups can filter on them, or leave them out to accept any semantics
+CREATE TABLE kat_best_gloss (
+	lex_id INTEGER NOT NULL,
+	lex_semclass TEXT NOT NULL,
+	lex_sem2 TEXT NOT NULL,
+	tr_language TEXT NOT NULL,
+	tr_id INTEGER NOT NULL,
+	tr_lexeme TEXT NOT NULL,
+	tr_semclass TEXT NOT NULL,
+	tr_sem2 TEXT NOT NULL,
+	tr_wordclass TEXT NOT NULL,
+
+	PRIMARY KEY (tr_language, lex_id)
+) WITHOUT ROWID;
+
+
+-- The version of the data, written by update.py along with it, so that the files built from the data can be matched to it
+CREATE TABLE kat_version (
+	version TEXT NOT NULL
+);
+
+
 CREATE TABLE glue_lexeme_synonyms (
 	lex_id INTEGER NOT NULL,
 	lex_syn INTEGER NOT NULL,
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+import argparse
+from katersat import add_arguments, filter_options, run
+from pipeline import Pipeline
+
+parser = argparse.ArgumentParser(prog='sems-gloss.py', description='Applies semantic tags and then foreign language glosses from Katersat to a stream of CG-formatted text, as apply-sems.py | gloss.py would')
+parser.add_argument('-l', '--last', action='store_true')
+parser.add_argument('--max-readings', type=int, default=0, help='expand a reading into at most this many readings with different sem codes (default: 0, no limit)')
+add_arguments(parser)
+parser.add_argument('lang', nargs='?', default='eng', help='language to gloss into, or several separated by commas, such as eng,dan, which are glossed in one pass and tagged <tr:eng> and <tr:dan>')
+args = parser.parse_args()
+
+run(Pipeline(last=args.last, max_readings=args.max_readings, lang=args.lang, **filter_options(args)), args)
@@ -0,0 +1,177 @@
+import json
+import mmap
+import sqlite3
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+
+# A read-only snapshot of the lookup data in kat_long_lookup, laid out so that it can be memory-mapped and used as is.
+# The file is MAGIC, the length of the JSON metadata as a uint32, the metadata, and then the sections it lists, each 8-byte aligned:
+#   strs       every distinct fst_ana in UTF-8, sorted and concatenated
+#   str_off    uint32[n+1], where analysis i is strs[str_off[i]:str_off[i+1]]
+#   row_off    uint32[n+1], where the rows of analysis i are row_off[i] to row_off[i+1], in lookup order
+#   row_lex    uint32[rows], the lex_id of each row
+#   row_attrs  uint32[rows], the let_attrs of each row
+#   row_unk    uint8[rows], whether the lexeme of each row has no semantic class
+#   slots      uint32[2^k], an open-addressing hash table of analysis numbers + 1 by CRC-32 of the analysis, 0 being empty
+#   lex_ids    uint32[lexs], the lexemes in sorted order
+#   lex_sem    uint16[lexs], the semclass of each lexeme, as an index into the metadata's sems
+#   lex_sem2   uint16[lexs], the sem2 of each lexeme, likewise
+#   prefixes   uint32[], the sorted CRC-32s of the keys in kat_long_prefix, where a collision only means a span is not pruned
+MAGIC = b'KATSNAP2'
+
+
+def _align(out):
+	out.write(b'\0' * (-out.tell() % 8))
+
+
+# Returns the header of a file that starts with magic and the metadata meta, padded so that what follows is 8-byte aligned
+def header(magic, meta):
+	head = json.dumps(meta).encode('UTF-8')
+	head += b' ' * (-(len(magic) + 4 + len(head)) % 8)
+	return magic + len(head).to_bytes(4, 'little') + head
+
+
+# Memory-maps a file written with header(), returning the map, the metadata, and where the data after the header starts
+def map_file(path, magic, what):
+	with open(path, 'rb') as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	if mm[0:len(magic)] != magic:
+		mm.close()
+		raise ValueError(f'{path} is not {what}')
+	hlen = int.from_bytes(mm[len(magic):len(magic)+4], 'little')
+	base = len(magic) + 4 + hlen
+	meta = json.loads(mm[len(magic)+4:base])
+	if meta['byteorder'] != sys.byteorder:
+		mm.close()
+		raise ValueError(f'{path} was written on a machine with a different byte order')
+	return mm, meta, base
+
+
+# Writes a snapshot of the database at db to path, tagged with the data version and the semantic class map
+def write(db, path, version, sem_map):
+	con = sqlite3.connect(f'file:{db}?mode=ro', uri=True)
+	cur = con.cursor()
+
+	strs = bytearray()
+	str_off = array('I', [0])
+	row_off = array('I', [0])
+	row_lex = array('I')
+	row_attrs = array('I')
+	row_unk = array('B')
+	last = None
+	cur.execute("SELECT fst_ana, lex_id, let_attrs, lex_semclass = 'UNK' FROM kat_long_lookup ORDER BY fst_ana ASC, lex_id ASC, seq ASC")
+	for ana, lex, attrs, unk in cur:
+		if ana != last:
+			if last is not None:
+				row_off.append(len(row_lex))
+			strs += ana.encode('UTF-8')
+			str_off.append(len(strs))
+			last = ana
+		row_lex.append(lex)
+		row_attrs.append(attrs)
+		row_unk.append(unk)
+	if last is not None:
+		row_off.append(len(row_lex))
+	n = len(str_off) - 1
+
+	size = 1
+	while size < n * 2:
+		size *= 2
+	slots = array('I', bytes(4 * size))
+	for i in range(n):
+		h = zlib.crc32(strs[str_off[i]:str_off[i+1]]) & (size - 1)
+		while slots[h]:
+			h = (h + 1) & (size - 1)
+		slots[h] = i + 1
+
+	sems = {}
+	lex_ids = array('I')
+	lex_sem = array('H')
+	lex_sem2 = array('H')
+	cur.execute("SELECT DISTINCT lex_id, lex_semclass, lex_sem2 FROM kat_long_lookup ORDER BY lex_id ASC")
+	for lex, sem, sem2 in cur:
+		lex_ids.append(lex)
+		lex_sem.append(sems.setdefault(sem, len(sems)))
+		lex_sem2.append(sems.setdefault(sem2, len(sems)))
+
+	cur.execute("SELECT DISTINCT prefix FROM kat_long_prefix")
+	prefixes = array('I', sorted({zlib.crc32(r[0].encode('UTF-8')) for r in cur}))
+	con.close()
+
+	sections = [('strs', bytes(strs)), ('str_off', str_off), ('row_off', row_off), ('row_lex', row_lex), ('row_attrs', row_attrs), ('row_unk', row_unk), ('slots', slots), ('lex_ids', lex_ids), ('lex_sem', lex_sem), ('lex_sem2', lex_sem2), ('prefixes', prefixes)]
+	meta = {
+		'version': version,
+		'byteorder': sys.byteorder,
+		'sem_map': sem_map,
+		'sems': list(sems),
+		'sections': {},
+	}
+	# The offsets depend on the length of the metadata, which depends on the offsets, so they are laid out relative to its end
+	pos = 0
+	for name, data in sections:
+		pos += -pos % 8
+		nbytes = len(data) * (data.itemsize if isinstance(data, array) else 1)
+		meta['sections'][name] = [pos, nbytes, data.typecode if isinstance(data, array) else 'B']
+		pos += nbytes
+	head = header(MAGIC, meta)
+	base = len(head)
+
+	with open(path, 'wb') as out:
+		out.write(head)
+		for name, data in sections:
+			_align(out)
+			assert out.tell() == base + meta['sections'][name][0]
+			out.write(data if isinstance(data, bytes) else data.tobytes())
+	return n
+
+
+# A memory-mapped snapshot. Pages are only read when used, and are shared by every process that maps the same file.
+class Snapshot:
+	def __init__(self, path):
+		self.mm, meta, base = map_file(path, MAGIC, 'a Katersat snapshot')
+		self.version = meta['version']
+		self.sem_map = meta['sem_map']
+		self.sems = meta['sems']
+		self.mv = memoryview(self.mm)
+		self.names = list(meta['sections'])
+		for name, (off, nbytes, code) in meta['sections'].items():
+			setattr(self, name, self.mv[base+off:base+off+nbytes].cast(code))
+		self.mask = len(self.slots) - 1
+
+	# Returns the number of an analysis, or -1
+	def find(self, ana):
+		key = ana.encode('UTF-8')
+		h = zlib.crc32(key) & self.mask
+		while s := self.slots[h]:
+			if self.strs[self.str_off[s-1]:self.str_off[s]] == key:
+				return s - 1
+			h = (h + 1) & self.mask
+		return -1
+
+	# Returns [(lex_id, let_attrs, is_unk), ...] for an analysis
+	def rows(self, ana):
+		i = self.find(ana)
+		if i < 0:
+			return []
+		return [(self.row_lex[k], self.row_attrs[k], self.row_unk[k] == 1) for k in range(self.row_off[i], self.row_off[i+1])]
+
+	# Returns (lex_semclass, lex_sem2) of a lexeme, or None
+	def lexeme(self, id):
+		k = bisect_left(self.lex_ids, id)
+		if k < len(self.lex_ids) and self.lex_ids[k] == id:
+			return self.sems[self.lex_sem[k]], self.sems[self.lex_sem2[k]]
+		return None
+
+	# Whether some analysis may have a prefix with this key
+	def has_prefix(self, key):
+		h = zlib.crc32(key.encode('UTF-8'))
+		k = bisect_left(self.prefixes, h)
+		return k < len(self.prefixes) and self.prefixes[k] == h
+
+	def close(self):
+		for name in self.names:
+			getattr(self, name).release()
+		self.mv.release()
+		self.mm.close()
@@ -0,0 +1,203 @@
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+import cg
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+LABELS = [f'<={b}' for b in BUCKETS] + [f'>{BUCKETS[-1]}']
+
+
+class Histogram:
+	def __init__(self):
+		self.counts = [0] * (len(BUCKETS) + 1)
+		self.n = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, ms):
+		self.counts[bisect_left(BUCKETS, ms)] += 1
+		self.n += 1
+		self.total += ms
+		if ms > self.max:
+			self.max = ms
+
+	def merge(self, other):
+		for i, c in enumerate(other.counts):
+			self.counts[i] += c
+		self.n += other.n
+		self.total += other.total
+		self.max = max(self.max, other.max)
+
+	# The upper bound of the bucket the p-th percentile falls in
+	def percentile(self, p):
+		k = self.n * p / 100
+		acc = 0
+		for i, c in enumerate(self.counts):
+			acc += c
+			if c and acc >= k:
+				return round(min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max, 3)
+		return round(self.max, 3)
+
+	def report(self):
+		return {
+			'n': self.n,
+			'total_ms': round(self.total, 3),
+			'mean_ms': round(self.total / self.n, 4) if self.n else 0,
+			'p50_ms': self.percentile(50),
+			'p99_ms': self.percentile(99),
+			'max_ms': round(self.max, 3),
+			'buckets': {label: c for label, c in zip(LABELS, self.counts) if c},
+		}
+
+
+# Sums nested dicts of counters
+def _add(a, b):
+	for k, v in b.items():
+		if isinstance(v, dict):
+			_add(a.setdefault(k, {}), v)
+		else:
+			a[k] = a.get(k, 0) + v
+	return a
+
+
+# Stands in for Stats when they are not wanted, at the cost of a method call per stage
+class NoStats:
+	def watch(self, con):
+		pass
+
+	def begin(self):
+		return 0
+
+	def now(self):
+		return 0
+
+	def lap(self, stage, t):
+		return 0
+
+
+# Runtime statistics of a filter: lines, readings and SQL statements, and how long each stage of processing a reading took,
+# as histograms. Readings that take longer than slow_ms are written to the slow log as JSON lines, with the time of each stage.
+class Stats(NoStats):
+	def __init__(self, out='-', slow_log=None, slow_ms=100.0):
+		self.out = sys.stderr if out in (None, '-') else open(out, 'a', buffering=1, encoding='UTF-8')
+		self.slow = open(slow_log, 'a', buffering=1, encoding='UTF-8') if slow_log else None
+		self.slow_ms = slow_ms
+		self.started = time.time()
+		self.workers = {}
+		# Reentrant, as SIGUSR1 may come while the main thread holds it
+		self.lock = threading.RLock()
+		self.reset()
+
+	def reset(self):
+		self.lines = 0
+		self.readings = 0
+		self.queries = 0
+		self.hists = {}
+		self.cur = {}
+
+	# Counts the SQL statements run on a connection
+	def watch(self, con):
+		con.set_trace_callback(self._query)
+
+	def _query(self, stmt):
+		self.queries += 1
+
+	# Starts a line, returning the time to end() it with
+	def begin(self):
+		self.cur = {}
+		return time.perf_counter()
+
+	def now(self):
+		return time.perf_counter()
+
+	# Adds the time since t to a stage of the current reading, and returns the time now for the next stage
+	def lap(self, stage, t):
+		now = time.perf_counter()
+		self.cur[stage] = self.cur.get(stage, 0) + (now - t) * 1000
+		return now
+
+	def _hist(self, name):
+		if (h := self.hists.get(name)) is None:
+			h = self.hists[name] = Histogram()
+		return h
+
+	# Ends a line begun at t. Lines that no stage was timed for are not readings.
+	def end(self, line, t):
+		ms = (time.perf_counter() - t) * 1000
+		self.lines += 1
+		if not self.cur:
+			return
+		self.readings += 1
+		self._timed('reading', ms, cg.text(line).rstrip('\n'))
+
+	# Ends a cohort begun at t, whose readings were processed together and are timed as one
+	def end_cohort(self, lines, t):
+		ms = (time.perf_counter() - t) * 1000
+		self.lines += len(lines)
+		if not self.cur:
+			return
+		self.readings += sum(1 for line in lines if isinstance(line, cg.Reading) or cg.is_reading(line))
+		self._timed('cohort', ms, '\n'.join(cg.text(line).rstrip('\n') for line in lines))
+
+	def _timed(self, name, ms, text):
+		self._hist(name).add(ms)
+		for stage, v in self.cur.items():
+			self._hist(stage).add(v)
+		if self.slow and ms >= self.slow_ms:
+			stages = {k: round(v, 3) for k, v in self.cur.items()}
+			self.slow.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid(), 'ms': round(ms, 3), 'stages': stages, 'line': text}, ensure_ascii=False) + '\n')
+
+	# Returns what was counted since the last call, and starts over. Workers send this to the main process after every block.
+	def take(self):
+		rv = (self.lines, self.readings, self.queries, self.hists)
+		self.reset()
+		return rv
+
+	# Adds what a worker counted, along with the latest counters of its filter
+	def merge(self, pid, counters, taken):
+		lines, readings, queries, hists = taken
+		with self.lock:
+			self.workers[pid] = counters
+			self.lines += lines
+			self.readings += readings
+			self.queries += queries
+			for name, h in hists.items():
+				self._hist(name).merge(h)
+
+	def report(self, counters=None, final=False):
+		with self.lock:
+			if counters is None:
+				counters = {}
+				for c in self.workers.values():
+					_add(counters, c)
+			secs = time.time() - self.started
+			return {
+				'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+				'pid': os.getpid(),
+				'final': final,
+				'elapsed_s': round(secs, 3),
+				'lines': self.lines,
+				'readings': self.readings,
+				'readings_per_s': round(self.readings / secs, 1) if secs else 0,
+				'queries': self.queries,
+				'counters': counters,
+				'stages': {name: h.report() for name, h in sorted(list(self.hists.items()))},
+			}
+
+	def dump(self, counters=None, final=False):
+		self.out.write(json.dumps(self.report(counters, final)) + '\n')
+		self.out.flush()
+
+	# Dumps every interval seconds, with the counters from get_counters(), until the returned event is set
+	def every(self, interval, get_counters):
+		done = threading.Event()
+
+		def tick():
+			while not done.wait(interval):
+				self.dump(get_counters())
+		threading.Thread(target=tick, daemon=True).start()
+		return done
@@ -0,0 +1,272 @@
+import itertools
+import math
+import regex as re
+import cg
+import katersat
+from katersat import Filter
+
+
+# Continuous mood with an object may also be found as indicative with any subject
+def cont_anas(ana):
+	c_anas = []
+	if re.search(r' Cont [123](Sg|Pl)O$', ana):
+		for ps in ['1Sg', '2Sg', '3Sg', '1Pl', '2Pl', '3Pl']:
+			for pso in ['3SgO', '3PlO']:
+				c_anas.append(re.sub(r' Cont [123](Sg|Pl)O$', f' Ind {ps} {pso}', ana))
+	return c_anas
+
+
+# Applies semantic tags from Katersat to CG readings
+class SemTagger(Filter):
+	stage = 'sems'
+
+	def __init__(self, last=False, max_readings=0, **kw):
+		self.last = last
+		self.max_readings = max_readings
+		super().__init__(**kw)
+		# Spans that were never looked up because no analysis starts with them
+		self.stats['pruned'] = 0
+		# How often the fallbacks found lexemes, per span looked up
+		self.stats['gram_strip'] = 0
+		self.stats['cont_ind'] = 0
+		# Spans that another reading of the same cohort already has
+		self.stats['shared'] = 0
+		# Readings that had more combinations of sem codes than max_readings
+		self.stats['capped'] = 0
+
+	def cache_ns(self):
+		ns = f'apply-sems:{int(self.last)}{int(self.trace)}'
+		if self.max_readings:
+			ns += f':{self.max_readings}'
+		return ns
+
+	# Returns (True, whether any lexemes were found, their sem codes) for the candidates of a span
+	def resolve(self, anas, found):
+		ids = {}
+		for ana in anas:
+			did = False
+			for r in found[ana]:
+				ids[str(r[0])] = ''
+				did = ((r[1] & 32) == 0)
+			if did:
+				if ana.startswith('"'):
+					cont = False
+					for c_ana in cont_anas(ana):
+						for r in found[c_ana]:
+							m = re.search(r' ([123](?:Sg|Pl)) ([123](?:Sg|Pl)O)$', c_ana)
+							ids[str(r[0])] = f' Heur/Cont/{m[1]} Heur/Cont/{m[2]}'
+							cont = True
+					if cont:
+						self.stats['cont_ind'] += 1
+				break
+
+			# Allow looking up morphemes without Gram/[HIT]V
+			if not ana.startswith('"'):
+				ana = re.sub(r' Gram/[HIT]V ', r' ', ana)
+				for r in found[ana]:
+					ids[str(r[0])] = ''
+					did = True
+				if did:
+					self.stats['gram_strip'] += 1
+					break
+
+		codes = []
+		if ids:
+			for sem in self.lk.sems(ids.keys()):
+				code = ''
+				if sem[0] != 'UNK' and sem[1] != 'UNK':
+					code = f'Sem/{self.sem_map[sem[0]]} Sem/{self.sem_map[sem[1]]}'
+				else:
+					code = f'Sem/{self.sem_map[sem[0]]}'
+				if ids[str(sem[2])] != '':
+					code += ids[str(sem[2])]
+				if self.trace:
+					code += f' SEM-LEX:{sem[2]}'
+				codes.append(code)
+		return (True, bool(ids), tuple(codes))
+
+	# Returns the readings with sem codes of a reading, such as '"qimmeq" N Abs Sg @SUBJ>', as strings without the tab of CG text
+	def tag_reading(self, reading):
+		return next(self.readings([reading]))
+
+	# As tag_reading(), for each of the readings in turn, which are processed in batches that share what they look up
+	def tag_readings(self, readings):
+		return self.readings(readings)
+
+	# Finds the spans of a reading that the memo has results for, and adds the candidates of the others to spans and cands
+	def plan(self, rd, spans, cands, t):
+		hyb = rd.hyb
+		cleans = rd.cleans
+		n = len(rd.origs)-1
+
+		# Spans are memoised on what their candidates are generated from, as (can be extended, found any lexemes, sem codes)
+		wcs = [cg.word_class(clean) for clean in cleans]
+		t = self.prof.lap('sems/parse', t)
+		keys = {}
+		results = {}
+		for i in range(n):
+			cur = ''
+			for j in range(i, n):
+				cur += cleans[j] + ' '
+				keys[i, j] = (cur.strip(), *wcs[j+1], hyb)
+				# Another reading of the cohort has the same span
+				if keys[i, j] in spans:
+					self.stats['shared'] += 1
+					continue
+				if (res := self.memo.get(keys[i, j])) is not None:
+					results[i, j] = res
+					if not res[0]:
+						break
+
+		# Every candidate of a span starts with the span, so once no analysis starts with a span, no longer span can match either
+		pkeys = {}
+		for i in range(n):
+			toks = []
+			for j in range(i, n):
+				toks += cleans[j].split(' ')
+				if (i, j) in results:
+					if not results[i, j][0]:
+						break
+				elif keys[i, j] not in spans:
+					pkeys[i, j] = katersat.prefix_key(toks)
+		prefixes = self.lk.prefixes(set(pkeys.values())) if pkeys else set()
+		t = self.prof.lap('sems/prune', t)
+
+		# Generate the candidates of every other span up front, so that they can all be looked up in one go
+		for i in range(n):
+			for j in range(i, n):
+				if (i, j) in results:
+					if not results[i, j][0]:
+						break
+					continue
+				if keys[i, j] in spans:
+					continue
+				if pkeys[i, j] not in prefixes:
+					self.stats['pruned'] += n - j
+					self.memo.put(keys[i, j], (False, False, ()))
+					break
+
+				cur, wc, flex, _ = keys[i, j]
+				ana = cur + ' ' + wc
+
+				anas = []
+				# Raw match for morpheme sequences
+				anas.append(ana)
+				if (m := re.match(r'^((?:i?\d?\p{Lu}\p{Ll}[^/\s]*(?: |$))+)', flex)):
+					flex = re.sub(r'\bi(\p{Lu})', r'\1', m[1]).split(' ')
+					for fi in range(len(flex), 0, -1):
+						ana2 = ('%s %s' % (ana, ' '.join(flex[0:fi]).strip()))
+						anas.append(ana2)
+						if re.search(r' \dPl(O)?$', ana2):
+							anas.append(re.sub(r' (\d)Pl(O)?$', r' \1Sg\2', ana2))
+						anas.append((ana + ' ' + re.sub(r'\b(Rel|Trm|Abl|Lok|Aeq|Ins|Via|Nom|Akk)\b', r'Abs', ' '.join(flex[0:fi]))).strip())
+				if wc != 'V':
+					anas.append(ana + ' Abs Sg')
+					anas.append(ana + ' Ins Sg')
+					anas.append(ana + ' Abs Pl')
+					anas.append(ana + ' Ins Pl')
+				else:
+					if re.search(r'^.* Gram/IV', ana) or re.search(r'^.* Gram/Refl', ana) or not re.search(r'^.* Gram/TV', ana):
+						anas.append(ana + ' Ind 3Sg')
+						anas.append(ana + ' Ind 3Pl')
+					if re.search(r'^.* Gram/TV', ana) or not re.search(r'^.* Gram/IV', ana):
+						anas.append(ana + ' Ind 3Sg 3SgO')
+						anas.append(ana + ' Ind 3Pl 3PlO')
+						anas.append(ana + ' Ind 3Sg 3PlO')
+						anas.append(ana + ' Ind 3Pl 3SgO')
+
+				if hyb:
+					anas.extend([re.sub(r'^"(\p{Lu}+)" ', r'\1 ', x) for x in anas])
+				#print(f'{i} {j}: {cur} | {anas}')
+
+				spans[keys[i, j]] = anas
+				for ana in anas:
+					cands.append(ana)
+					if ana.startswith('"'):
+						cands.extend(cont_anas(ana))
+					else:
+						cands.append(re.sub(r' Gram/[HIT]V ', r' ', ana))
+
+		self.prof.lap('sems/candidates', t)
+		return keys, results
+
+	# Resolves the spans of a reading, each at most once per cohort, and returns its output without the suffix
+	def finish(self, rd, keys, results, spans, found, resolved):
+		t = self.prof.now()
+		origs = rd.origs
+		n = len(origs)-1
+
+		sems = {}
+		for i in range(n):
+			sems[i] = set()
+
+		longest = False
+		max_j = 0
+
+		for i in range(n):
+			for j in range(i, n):
+				# If we are at the last morpheme and there already is a longest match, stop
+				if j == n-1 and longest:
+					break
+
+				if (i, j) not in results and (key := keys.get((i, j))) in spans:
+					if key not in resolved:
+						resolved[key] = self.resolve(spans[key], found)
+						self.memo.put(key, resolved[key])
+					results[i, j] = resolved[key]
+				_, matched, codes = results.get((i, j), (False, False, ()))
+				if matched:
+					for code in codes:
+						sems[j].add(code)
+						max_j = max(j, max_j)
+
+						if i == 0 and j == n-1:
+							longest = True
+
+					# If we are looking for long matches from baseform, only keep the longest match
+					if i == 0:
+						# But, roots should keep their own semantics, as morphemes do, so start at 1
+						for k in range(1, max_j):
+							sems[k] = set()
+
+
+		t = self.prof.lap('sems/resolve', t)
+		if self.last:
+			for i in range(max_j):
+				sems[i] = set()
+
+		# Mark semantics before derivation as internal. No sem code is a derivation, so whether a tag is internal doesn't
+		# depend on the codes around it, and each morpheme and code can be marked once, from the end, before expansion.
+		last = origs[-1].rstrip().split(' ')
+		seen = cg.mark_sems(last, cg.rx_der_sem)
+		choices = [None] * n
+		for i in range(n-1, -1, -1):
+			choices[i] = []
+			for sem in sorted(sems[i]):
+				code = sem.split(' ')
+				cg.mark_sems(code, cg.rx_der_sem, seen, False)
+				choices[i].append((origs[i] + ' ' + sem, ' '.join(code)))
+			orig = origs[i].split(' ')
+			seen = cg.mark_sems(orig, cg.rx_der_sem, seen, False)
+			orig = ' '.join(orig)
+			if choices[i]:
+				choices[i] = [(plain, orig + ' ' + code) for plain, code in choices[i]]
+			else:
+				choices[i] = [(origs[i], orig)]
+
+		# Each combination of the sem codes of the morphemes is a reading, in the order of the unmarked readings, as long as
+		# there are no more than max_readings of them
+		combos = itertools.product(*choices)
+		if self.max_readings and math.prod(len(c) for c in choices) > self.max_readings:
+			self.stats['capped'] += 1
+			combos = itertools.islice(combos, self.max_readings)
+		outs = {}
+		for combo in combos:
+			outs.setdefault(' '.join(c[0] for c in combo), combo)
+		tail = ' '.join(last)
+		news = [(' '.join(c[1] for c in outs[out]) + ' ' + tail).strip() for out in sorted(outs)]
+
+		self.cache[rd.line] = news
+		self.prof.lap('sems/output', t)
+		return news
+
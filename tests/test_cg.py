@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Checks the single-pass rewrites in cg.py against the step-wise regular expressions they replace, over the readings in
+# readings.cg and over random sequences of the tokens those regular expressions care about.
+# Usage: python -m pytest tests
+import os
+import random
+import sys
+import regex as re
+
+tests = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests, '..'))
+import cg
+
+# What apply-sems.py and gloss.py repeated until nothing changed
+rx_sems = re.compile(r' (Sem/\S+.*? \p{Lu}[_\p{Lu}]+ )')
+rx_sems_u = re.compile(r' (Sem/\S+.*? (?:U|\p{Lu}[_\p{Lu}]+) )')
+rx_wcs = re.compile(r' ((?:N|V|Pali|Conj|Adv|Interj|Pron|Prop|Num|Symbol) .*? (?:(?:U|\p{Lu}\p{Lu}+)|(?:N|V|Pali|Conj|Adv|Interj|Pron|Prop|Num|Symbol)) )')
+
+# Tokens of readings, suffixes and sem codes, with the near misses of each
+VOCAB = [
+	'"w"', 'N', 'V', 'Pron', 'Prop', 'Adv', 'Num', 'Abs', 'Rel', 'Ins', 'Sg', 'Pl', 'Du', '3Sg', '1Pl', '3SgO', '3PlPoss', '1SgO',
+	'LI', 'LU', 'LUUNNIIT', 'ADV-LI', 'CONJ-LU', 'LIK', 'SOQ', 'GE', 'U', 'A_B', 'Aa', 'Der/nv', 'Gram/IV', 'Hyb/x',
+	'Sem/Hum', 'Sem/Geo', 'Sem/', 'iSem/Animal', 'Sem/Concessive', '¤', '¤a', '¤b', '%', '%x', '%y', '@', '@SUBJ>', '@<OBJ',
+	'#', '#x', '#1->2', '#3->4', '<x>', 'foo',
+]
+
+
+def fixture():
+	with open(os.path.join(tests, 'readings.cg'), encoding='UTF-8') as f:
+		return [line.strip() for line in f if cg.is_reading(line.rstrip())]
+
+
+def generated(n=20000, seed=1):
+	rnd = random.Random(seed)
+	for _ in range(n):
+		yield ' '.join(['"w"'] + [rnd.choice(VOCAB) for _ in range(rnd.randint(0, 12))])
+
+
+def repeat(rx, line):
+	while (o := rx.sub(r' i\1', line)) != line:
+		line = o
+	return line
+
+
+# As the tagger calls it, a part at a time from the end
+def mark_sems_parts(tokens, ders, rnd):
+	cuts = sorted(rnd.sample(range(1, len(tokens)), min(rnd.randint(0, 3), len(tokens) - 1))) if len(tokens) > 1 else []
+	parts = [tokens[a:b] for a, b in zip([0] + cuts, cuts + [len(tokens)])]
+	seen = cg.mark_sems(parts[-1], ders)
+	for part in reversed(parts[:-1]):
+		seen = cg.mark_sems(part, ders, seen, False)
+	return [t for part in parts for t in part]
+
+
+def test_split_suffix():
+	for line in fixture() + list(generated()):
+		assert cg.split_suffix(line) == cg._split_suffix_chain(line), line
+
+
+def test_mark_sems():
+	rnd = random.Random(2)
+	lines = [cg.split_suffix(line)[0] for line in fixture()] + list(generated(seed=2))
+	for line in lines:
+		tokens = line.split(' ')
+		cg.mark_sems(tokens, cg.rx_der_sem)
+		assert ' '.join(tokens) == repeat(rx_sems, line), line
+		assert ' '.join(mark_sems_parts(line.split(' '), cg.rx_der_sem, rnd)) == repeat(rx_sems, line), line
+		tokens = line.split(' ')
+		cg.mark_sems(tokens, cg.rx_der_sem_u)
+		assert ' '.join(tokens) == repeat(rx_sems_u, line), line
+
+
+def test_mark_wcs():
+	lines = [cg.split_suffix(line)[0] for line in fixture()] + list(generated(seed=3))
+	for line in lines:
+		assert ' '.join(cg.mark_wcs(line.split(' '))) == repeat(rx_wcs, line), line
+		# As the glosser runs them, after the Sem/ tags are marked
+		tokens = line.split(' ')
+		cg.mark_sems(tokens, cg.rx_der_sem_u)
+		assert ' '.join(cg.mark_wcs(tokens)) == repeat(rx_wcs, repeat(rx_sems_u, line)), line
@@ -2,16 +2,314 @@
 import sys
 import os
 import re
+import argparse
+import shutil
 import subprocess
 import hashlib
+import multiprocessing
+import time
 from pathlib import Path
 import sqlite3
+import katersat
+import bloom
+import snapshot
 
 def sha1_file(fn):
 	d = Path(fn).read_bytes()
 	h = hashlib.sha1(d)
 	return h.hexdigest()
 
+# Splits SQL text into complete statements, reading it line by line
+def statements(lines):
+	stmt = []
+	for line in lines:
+		stmt.append(line)
+		if line.rstrip().endswith(';') and sqlite3.complete_statement(s := ''.join(stmt)):
+			yield s
+			stmt = []
+	if stmt and (s := ''.join(stmt)).strip():
+		yield s
+
+# The amount of data.sql that is loaded per transaction
+CHUNK_BYTES = 1 << 24
+
+# Returns the analyses in kat_long_raw for a kal lexeme row (lex_id, lex_lexeme, lex_stem, lex_valence), along with any warnings
+def stem_variants(row):
+	anas = []
+	warnings = []
+	id = row[0]
+	stems = row[2].strip().split('\n')
+	if m := re.search(r'.* Der/[nv]([nv])', row[1]):
+		anas.append((row[1] + ' ' + m[1].capitalize(), id))
+	for stem in stems:
+		if not stem:
+			continue
+		m = None
+		if not (m := re.match(r'^(\+?[^+]*)\+(.*)$', stem)):
+			warnings.append(f'Warning: Lexeme {id} invalid analysis {stem}')
+			continue
+		stem = f'"{m[1]}" ' + m[2].replace('+', ' ')
+		stem = re.sub(r' Gram/((?:[HIT]V)|(?:Refl))\b', r' gram/\1', stem)
+		stem = re.sub(r' (Gram|Dial|Orth|O[lL]ang|Heur|Hyb|Err)/(\S+)', r'', stem)
+		stem = stem.replace(' gram/', ' Gram/')
+		anas.append((stem, id))
+		if ' Gram/HV Gram/IV ' in stem:
+			#print(f'Reducing Gram/HV Gram/IV in {stem}')
+			stem = stem.replace(' Gram/HV Gram/IV ', ' Gram/HV ')
+			anas.append((stem, id))
+		if 'Gram/' not in stem:
+			if row[3] == 1:
+				#print(f'Adding Gram/IV to {stem}')
+				stem = stem.replace('" ', '" Gram/IV ')
+				anas.append((stem, id))
+			if row[3] == 2:
+				#print(f'Adding Gram/TV to {stem}')
+				stem = stem.replace('" ', '" Gram/TV ')
+				anas.append((stem, id))
+	return anas, warnings
+
+def stem_variants_many(rows):
+	anas = []
+	warnings = []
+	for row in rows:
+		a, w = stem_variants(row)
+		anas.extend(a)
+		warnings.extend(w)
+	return anas, warnings
+
+SERVING_PAGE_SIZE = 4096
+
+# Creates the tables of schema.sql, returning the CREATE INDEX statements so they can be run once the data is in
+def create(con):
+	indexes = []
+	schema = []
+	for stmt in statements(Path('schema.sql').read_text(encoding='UTF-8').splitlines(keepends=True)):
+		if stmt.lstrip().upper().startswith('CREATE INDEX'):
+			indexes.append(stmt)
+		else:
+			schema.append(stmt)
+	con.executescript(''.join(schema))
+	return indexes
+
+def load(con, fn):
+	with open(fn, encoding='UTF-8') as f:
+		chunk = []
+		size = 0
+		for stmt in statements(f):
+			# The whole load is done in our own transactions
+			if re.match(r'^\s*(?:BEGIN|COMMIT|END)\b', stmt, re.I):
+				continue
+			chunk.append(stmt)
+			size += len(stmt)
+			if size >= CHUNK_BYTES:
+				con.executescript('BEGIN;\n' + ''.join(chunk) + '\nCOMMIT;')
+				chunk = []
+				size = 0
+		con.executescript('BEGIN;\n' + ''.join(chunk) + '\nCOMMIT;')
+
+# Fills the derived tables inside the caller's transaction. Without conditions, that is for all lexemes;
+# otherwise expand and rank are subqueries of the lex_ids to generate analyses for and to rank glosses of.
+def derive(con, expand='', rank=''):
+	db = con.cursor()
+	w_expand = f' AND lex_id IN ({expand})' if expand else ''
+	w_lookup = f' AND kl.lex_id IN ({expand})' if expand else ''
+	w_rank = f' AND kl.lex_id IN ({rank})' if rank else ''
+
+	t = time.perf_counter()
+	db.execute(f"SELECT DISTINCT * FROM (SELECT lex_id, lex_lexeme, lex_stem, lex_valence FROM kat_lexemes WHERE lex_language = 'kal' AND lex_lexeme NOT LIKE '% %' UNION SELECT lex_id, lex_lexeme, lex_stem, lex_valence FROM kat_lexemes WHERE lex_language = 'kal' AND lex_lexeme LIKE '% Der/%') WHERE 1{w_expand} ORDER BY lex_id ASC")
+	rows = db.fetchall()
+	# Variants are generated in parallel, but inserted in lexeme order, which is the order lookups see them in
+	batches = [rows[k:k+1000] for k in range(0, len(rows), 1000)]
+	if len(batches) > 1:
+		with multiprocessing.get_context('fork').Pool() as pool:
+			results = list(pool.imap(stem_variants_many, batches))
+	else:
+		results = list(map(stem_variants_many, batches))
+	for anas, warnings in results:
+		for w in warnings:
+			print(w)
+		db.executemany("INSERT INTO kat_long_raw VALUES (?, ?)", anas)
+	print(f'Variants: {len(rows)} lexemes in {time.perf_counter() - t:.2f}s')
+
+	t = time.perf_counter()
+	db.execute(f"INSERT INTO kat_long_lookup SELECT fst_ana, kl.lex_id, ROW_NUMBER() OVER (PARTITION BY kl.lex_id ORDER BY klr.rowid ASC), lex_semclass, lex_sem2, COALESCE(let_attrs, 0) FROM kat_long_raw as klr NATURAL JOIN kat_lexemes as kl LEFT JOIN kat_lexeme_attrs as kla ON (kl.lex_id = kla.lex_id) WHERE lex_semclass != 'meta-cat-lib'{w_lookup}")
+	rows = db.execute(f"SELECT DISTINCT fst_ana, lex_id FROM kat_long_lookup WHERE 1{w_expand}").fetchall()
+	db.executemany("INSERT INTO kat_long_prefix VALUES (?, ?)", {(p, lex) for ana, lex in rows for p in katersat.prefix_keys(ana)})
+	db.execute(f"""INSERT INTO kat_best_gloss
+SELECT lex_id, lex_semclass, lex_sem2, tr_language, tr_id, tr_lexeme, tr_semclass, tr_sem2, tr_wordclass FROM (
+	SELECT kl.lex_id, kl.lex_semclass, kl.lex_sem2, tr.lex_language as tr_language, tr.lex_id as tr_id, tr.lex_lexeme as tr_lexeme, tr.lex_semclass as tr_semclass, tr.lex_sem2 as tr_sem2, tr.lex_wordclass as tr_wordclass, ROW_NUMBER() OVER (PARTITION BY kl.lex_id, tr.lex_language ORDER BY gls.syn_order ASC, tr.lex_id ASC) as rank
+	FROM kat_lexemes as kl NATURAL JOIN glue_lexeme_synonyms AS gls INNER JOIN kat_lexemes as tr ON (gls.lex_syn = tr.lex_id)
+	WHERE kl.lex_language = 'kal'{w_rank}
+) WHERE rank = 1""")
+	print(f'Lookup tables: {time.perf_counter() - t:.2f}s')
+
+# Builds a new database from scratch
+def build(fn, version):
+	subprocess.run(['rm', '-f', fn])
+	con = sqlite3.connect(fn, isolation_level=None)
+
+	t = time.perf_counter()
+	indexes = create(con)
+	print(f'Schema: {time.perf_counter() - t:.2f}s')
+
+	t = time.perf_counter()
+	load(con, 'data.sql')
+	print(f'Data: {time.perf_counter() - t:.2f}s')
+
+	print('Converting longest match...')
+	con.execute("BEGIN")
+	derive(con)
+	stamp(con, version)
+	con.execute("COMMIT")
+
+	# Indexes are created once all the data is in, which is much faster than keeping them up to date row by row
+	t = time.perf_counter()
+	con.executescript('BEGIN;\n' + ''.join(indexes) + '\nCOMMIT;')
+	print(f'Indexes: {time.perf_counter() - t:.2f}s')
+	con.close()
+
+# Records the version of the data in the database, in the transaction that writes the data
+def stamp(con, version):
+	con.execute("DELETE FROM kat_version")
+	con.execute("INSERT INTO kat_version VALUES (?)", [version])
+
+# The version that stamp() recorded in a database, or None for one from before kat_version
+def built_version(fn):
+	if not os.path.exists(fn):
+		return None
+	con = sqlite3.connect(f'file:{fn}?mode=ro', uri=True)
+	try:
+		return con.execute("SELECT version FROM kat_version").fetchone()[0]
+	except (sqlite3.Error, TypeError):
+		return None
+	finally:
+		con.close()
+
+# Makes the rows of table t in main the same as in new, returning the primary keys of the rows that were deleted, inserted, or changed
+def sync(db, t):
+	pks = [r[1] for r in sorted(db.execute(f"PRAGMA main.table_info({t})").fetchall(), key=lambda r: r[5]) if r[5]]
+	cols = [r[1] for r in db.execute(f"PRAGMA main.table_info({t})").fetchall()]
+	on = ' AND '.join(f'o.{c} = n.{c}' for c in pks)
+	same = ' AND '.join(f'o.{c} IS n.{c}' for c in cols)
+	keys = ', '.join(f'o.{c}' for c in pks)
+
+	changed = db.execute(f"SELECT {keys} FROM main.{t} as o LEFT JOIN new.{t} as n ON ({on}) WHERE n.{pks[0]} IS NULL OR NOT ({same})").fetchall()
+	db.execute(f"DELETE FROM main.{t} WHERE rowid IN (SELECT o.rowid FROM main.{t} as o LEFT JOIN new.{t} as n ON ({on}) WHERE n.{pks[0]} IS NULL OR NOT ({same}))")
+	added = db.execute(f"SELECT {keys.replace('o.', 'n.')} FROM new.{t} as n LEFT JOIN main.{t} as o ON ({on}) WHERE o.{pks[0]} IS NULL").fetchall()
+	db.execute(f"INSERT INTO main.{t} SELECT n.* FROM new.{t} as n LEFT JOIN main.{t} as o ON ({on}) WHERE o.{pks[0]} IS NULL")
+	return set(changed) | set(added)
+
+# Updates a copy of the current database with only what changed in data.sql, recomputing the derived tables for the affected lexemes
+def update(fn, version):
+	t = time.perf_counter()
+	subprocess.run(['rm', '-f', fn, fn + '.stage'])
+	con = sqlite3.connect(fn + '.stage', isolation_level=None)
+	create(con)
+	load(con, 'data.sql')
+	con.close()
+	print(f'Data: {time.perf_counter() - t:.2f}s')
+
+	t = time.perf_counter()
+	shutil.copyfile('katersat.sqlite', fn)
+	con = sqlite3.connect(fn, isolation_level=None)
+	db = con.cursor()
+	db.execute("PRAGMA journal_mode = MEMORY")
+	db.execute("PRAGMA synchronous = OFF")
+	db.execute("ATTACH DATABASE ? AS new", [fn + '.stage'])
+	db.execute("BEGIN")
+
+	tables = [r[0] for r in db.execute("SELECT name FROM new.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name ASC")]
+	# Rows can only be matched between tables that are laid out the same and have a primary key
+	schema = "SELECT name, sql FROM {}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name ASC"
+	if db.execute(schema.format('main')).fetchall() != db.execute(schema.format('new')).fetchall():
+		raise ValueError('the tables are not laid out as in katersat.sqlite')
+	for tbl in tables:
+		if tbl not in katersat.DERIVED and not any(r[5] for r in db.execute(f"PRAGMA new.table_info({tbl})")):
+			raise ValueError(f'{tbl} has no primary key')
+	lexs = set()
+	glosses = set()
+	for tbl in tables:
+		if tbl in katersat.DERIVED:
+			continue
+		keys = sync(db, tbl)
+		if keys:
+			print(f'{tbl}: {len(keys)} changed')
+		if tbl in ('kat_lexemes', 'kat_lexeme_attrs'):
+			lexs |= {k[0] for k in keys}
+		if tbl == 'glue_lexeme_synonyms':
+			glosses |= {k[0] for k in keys}
+	print(f'Diff: {time.perf_counter() - t:.2f}s')
+
+	t = time.perf_counter()
+	# Lexemes that changed are expanded again, and their best glosses ranked again
+	db.execute("CREATE TEMP TABLE expand (lex_id INTEGER NOT NULL, PRIMARY KEY (lex_id))")
+	db.executemany("INSERT INTO expand VALUES (?)", [[id] for id in lexs])
+	db.execute("DELETE FROM kat_long_raw WHERE lex_id IN (SELECT lex_id FROM expand)")
+	db.execute("DELETE FROM kat_long_lookup WHERE lex_id IN (SELECT lex_id FROM expand)")
+	db.execute("DELETE FROM kat_long_prefix WHERE lex_id IN (SELECT lex_id FROM expand)")
+	db.execute("CREATE TEMP TABLE affected (lex_id INTEGER NOT NULL, PRIMARY KEY (lex_id))")
+	db.execute("INSERT INTO affected SELECT lex_id FROM expand")
+	# The best gloss also changes with the synonyms of a lexeme and with the lexemes they point to
+	glosses |= {r[0] for r in db.execute("SELECT lex_id FROM glue_lexeme_synonyms WHERE lex_syn IN (SELECT lex_id FROM expand)")}
+	db.executemany("INSERT OR IGNORE INTO affected VALUES (?)", [[id] for id in glosses])
+	db.execute("DELETE FROM kat_best_gloss WHERE lex_id IN (SELECT lex_id FROM affected)")
+	print(f'Affected: {len(lexs)} lexemes, {len(glosses | lexs)} glosses in {time.perf_counter() - t:.2f}s')
+
+	derive(con, 'SELECT lex_id FROM expand', 'SELECT lex_id FROM affected')
+	stamp(con, version)
+	db.execute("COMMIT")
+	db.execute("DETACH DATABASE new")
+	con.close()
+	subprocess.run(['rm', '-f', fn + '.stage'])
+
+# Writes a copy of the database at src to dst for the scripts to read, as katersat-serving.sqlite. schema.sql is laid out for
+# loading, with large pages; this has small pages, so a lookup reads little more than it needs, no duplicate analyses, and
+# statistics for the query planner. The scripts open it immutable, so it must only ever be replaced, never changed in place.
+def serving(src, dst):
+	subprocess.run(['rm', '-f', dst])
+	con = sqlite3.connect(f'file:{src}?mode=ro', uri=True, isolation_level=None)
+	con.execute(f"PRAGMA page_size = {SERVING_PAGE_SIZE}")
+	con.execute("VACUUM INTO ?", [dst])
+	con.close()
+
+	con = sqlite3.connect(dst, isolation_level=None)
+	db = con.cursor()
+	db.execute("PRAGMA journal_mode = OFF")
+	db.execute("PRAGMA synchronous = OFF")
+	db.execute("BEGIN")
+	# A stem's variants may repeat an analysis, which kat_long_lookup then has several times over, with the same lexeme and attributes
+	db.execute("DELETE FROM kat_long_raw WHERE rowid NOT IN (SELECT MIN(rowid) FROM kat_long_raw GROUP BY fst_ana, lex_id)")
+	dupes = db.rowcount
+	db.execute("DELETE FROM kat_long_lookup AS o WHERE EXISTS (SELECT 1 FROM kat_long_lookup AS i WHERE i.fst_ana = o.fst_ana AND i.lex_id = o.lex_id AND i.seq < o.seq)")
+	db.execute("COMMIT")
+	db.execute("ANALYZE")
+	db.execute("PRAGMA optimize")
+	db.execute("VACUUM")
+	con.close()
+	return dupes
+
+# Whether two databases hold the same data. kat_long_raw is compared by the order of rows within each lexeme, as rowids differ.
+def same(a, b):
+	con = sqlite3.connect(a)
+	db = con.cursor()
+	db.execute("ATTACH DATABASE ? AS b", [b])
+	rv = True
+	for t, in db.execute("SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name ASC").fetchall():
+		sel = '*'
+		if t == 'kat_long_raw':
+			sel = 'fst_ana, lex_id, ROW_NUMBER() OVER (PARTITION BY lex_id ORDER BY rowid ASC)'
+		n = db.execute(f"SELECT COUNT(*) FROM (SELECT * FROM (SELECT {sel} FROM main.{t} EXCEPT SELECT {sel} FROM b.{t}) UNION ALL SELECT * FROM (SELECT {sel} FROM b.{t} EXCEPT SELECT {sel} FROM main.{t}))").fetchone()[0]
+		if n:
+			print(f'Warning: {t} differs in {n} rows')
+			rv = False
+	con.close()
+	return rv
+
+parser = argparse.ArgumentParser(prog='update.py', description='Downloads Katersat and updates katersat.sqlite with the changes, or rebuilds it')
+parser.add_argument('--full', action='store_true', help='always rebuild katersat.sqlite from scratch')
+parser.add_argument('--check', action='store_true', help='also do a full rebuild, and use it if the incremental update differs from it')
+args = parser.parse_args()
+
 dir = os.path.dirname(__file__)
 os.chdir(dir)
 
@@ -29,66 +327,73 @@ if os.path.exists('data.sql'):
 	else:
 		sha = sha1_file('data.sql')
 		Path('etag.txt').write_text(sha)
+# After an update that failed, data.sql is newer than the data katersat.sqlite was built from, which is what counts
+built = built_version('katersat.sqlite')
+if built is not None and built != sha.strip():
+	sha = built
+	Path('etag.txt').write_text(sha)
 
 subprocess.run(['curl', '-D', 'headers.txt', '--no-progress-meter', '--compressed', '--etag-compare', 'etag.txt', '--etag-save', 'etag-new.txt', 'https://tech.oqaasileriffik.gl/katersat/export-katersat.php', '-o', 'data.sql'])
 
+# The new ETag is only kept once the data it is of is in place, so that an update that fails is tried again
+etag = 'etag.txt'
 if os.path.getsize('etag-new.txt'):
-	os.rename('etag-new.txt', 'etag.txt')
+	etag = 'etag-new.txt'
 
 new=sha
-if os.path.getmtime('etag.txt') <= os.path.getmtime('data.sql'):
+if os.path.getmtime(etag) <= os.path.getmtime('data.sql'):
 	new = sha1_file('data.sql')
 
 if sha == new:
 	print('Katersat is already up to date')
+	if etag == 'etag-new.txt':
+		os.replace('etag-new.txt', 'etag.txt')
 	sys.exit()
 
 
 print('Loading new Katersat data...')
-subprocess.run(['rm', '-f', 'katersat.sqlite.new'])
-subprocess.run(['sqlite3', 'katersat.sqlite.new', '-init', 'schema.sql'], input='')
-subprocess.run(['sqlite3', 'katersat.sqlite.new', '-init', 'data.sql'], input='')
-Path('etag.txt').write_text(new)
-print('Converting longest match...')
+t = time.perf_counter()
+full = args.full or not os.path.exists('katersat.sqlite')
+if not full:
+	try:
+		update('katersat.sqlite.new', new.strip())
+	except (sqlite3.Error, ValueError) as e:
+		print(f'Warning: Incremental update failed ({e}), rebuilding')
+		subprocess.run(['rm', '-f', 'katersat.sqlite.new.stage'])
+		full = True
+if full:
+	build('katersat.sqlite.new', new.strip())
+elif args.check:
+	print('Checking against a full rebuild...')
+	build('katersat.sqlite.full', new.strip())
+	if same('katersat.sqlite.new', 'katersat.sqlite.full'):
+		os.remove('katersat.sqlite.full')
+	else:
+		print('Warning: Incremental update differs from a full rebuild, using the full rebuild')
+		os.replace('katersat.sqlite.full', 'katersat.sqlite.new')
 
+t2 = time.perf_counter()
 con = sqlite3.connect('katersat.sqlite.new')
-db = con.cursor()
-
-db.execute("SELECT DISTINCT * FROM (SELECT lex_id, lex_lexeme, lex_stem, lex_valence FROM kat_lexemes WHERE lex_language = 'kal' AND lex_lexeme NOT LIKE '% %' UNION SELECT lex_id, lex_lexeme, lex_stem, lex_valence FROM kat_lexemes WHERE lex_language = 'kal' AND lex_lexeme LIKE '% Der/%')")
-rows = db.fetchall()
-for row in rows:
-	id = row[0]
-	stems = row[2].strip().split('\n')
-	if m := re.search(r'.* Der/[nv]([nv])', row[1]):
-		db.execute("INSERT INTO kat_long_raw VALUES (?, ?)", [row[1] + ' ' + m[1].capitalize(), id])
-	for stem in stems:
-		if not stem:
-			continue
-		m = None
-		if not (m := re.match(r'^(\+?[^+]*)\+(.*)$', stem)):
-			print(f'Warning: Lexeme {id} invalid analysis {stem}')
-			continue
-		stem = f'"{m[1]}" ' + m[2].replace('+', ' ')
-		stem = re.sub(r' Gram/((?:[HIT]V)|(?:Refl))\b', r' gram/\1', stem)
-		stem = re.sub(r' (Gram|Dial|Orth|O[lL]ang|Heur|Hyb|Err)/(\S+)', r'', stem)
-		stem = stem.replace(' gram/', ' Gram/')
-		db.execute("INSERT INTO kat_long_raw VALUES (?, ?)", [stem, id])
-		if ' Gram/HV Gram/IV ' in stem:
-			#print(f'Reducing Gram/HV Gram/IV in {stem}')
-			stem = stem.replace(' Gram/HV Gram/IV ', ' Gram/HV ')
-			db.execute("INSERT INTO kat_long_raw VALUES (?, ?)", [stem, id])
-		if 'Gram/' not in stem:
-			if row[3] == 1:
-				#print(f'Adding Gram/IV to {stem}')
-				stem = stem.replace('" ', '" Gram/IV ')
-				db.execute("INSERT INTO kat_long_raw VALUES (?, ?)", [stem, id])
-			if row[3] == 2:
-				#print(f'Adding Gram/TV to {stem}')
-				stem = stem.replace('" ', '" Gram/TV ')
-				db.execute("INSERT INTO kat_long_raw VALUES (?, ?)", [stem, id])
+sem_map = katersat.load_sem_map(con.cursor())
+con.close()
+n = snapshot.write('katersat.sqlite.new', 'katersat.snap.new', new.strip(), sem_map)
+print(f'Snapshot: {n} analyses in {time.perf_counter() - t2:.2f}s')
+t2 = time.perf_counter()
+n = bloom.write('katersat.sqlite.new', 'katersat.bloom.new', new.strip())
+print(f'Bloom filter: {n} analyses in {time.perf_counter() - t2:.2f}s')
+t2 = time.perf_counter()
+n = serving('katersat.sqlite.new', 'katersat-serving.sqlite.new')
+print(f'Serving copy: {n} duplicate analyses removed in {time.perf_counter() - t2:.2f}s')
 
-con.commit()
+for fn in ('katersat.sqlite.new', 'katersat-serving.sqlite.new'):
+	print(f'{fn[:-4]}: {os.path.getsize(fn) / 1048576:.1f} MiB')
 
+# Swapped in atomically, so running scripts keep reading the old files until they reopen them
+os.rename('katersat.snap.new', 'katersat.snap')
+os.rename('katersat.bloom.new', 'katersat.bloom')
+os.rename('katersat-serving.sqlite.new', 'katersat-serving.sqlite')
 os.rename('katersat.sqlite.new', 'katersat.sqlite')
+Path('etag.txt').write_text(new)
+subprocess.run(['rm', '-f', 'etag-new.txt'])
 
-print('Katersat updated')
+print(f'Katersat updated in {time.perf_counter() - t:.2f}s')